@@ -0,0 +1,310 @@
+'''Local stand-ins for the upstream APIs ADARCA talks to.
+
+Each fake runs its own threaded HTTP server on a free localhost port, so latency
+and errors can be injected per upstream. The fakes only implement the requests
+ADARCA makes, and answer them with a small generated inventory of sites where
+every device is up and no provider outage is active.
+'''
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+UPSTREAMS = ('prtg', 'snow', 'meraki', 'netcloud', 'gis', 'geocode', 'opsgenie', 'cisco')
+
+class FakeUpstream:
+    '''HTTP server answering requests with the first route whose method and path match.
+
+    Parameters
+    ----------
+    name : str
+        Name of the upstream, e.g. prtg.
+    routes : list
+        (method, path regex, handler) tuples. Handlers are called with the path
+        match, the parsed query string and the decoded JSON body, and return a
+        (status, payload) tuple.
+    latency : float
+        Seconds added to every response.
+    jitter : float
+        Latency varies uniformly by up to this many seconds either way.
+    error_rate : float
+        Share of requests answered with 503 instead.
+    '''
+    def __init__(self, name, routes, latency=0.0, jitter=0.0, error_rate=0.0):
+        self.name = name
+        self.routes = [(method, re.compile(pattern), handler) for method, pattern, handler in routes]
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.requests = 0
+        self._server = None
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                fake.requests += 1
+                length = int(self.headers.get('Content-Length') or 0)
+                raw = self.rfile.read(length) if length else b''
+                delay = fake.latency + random.uniform(-fake.jitter, fake.jitter)
+                if delay > 0:
+                    time.sleep(delay)
+                if random.random() < fake.error_rate:
+                    return self._send(503, {'error': f'{fake.name} error injected by benchmark'})
+                url = urlparse(self.path)
+                query = {k: v if len(v) > 1 else v[0] for k, v in parse_qs(url.query).items()}
+                try:
+                    body = json.loads(raw) if raw else None
+                except ValueError:
+                    body = None
+                for method, pattern, handler in fake.routes:
+                    match = pattern.fullmatch(unquote(url.path))
+                    if method == self.command and match:
+                        return self._send(*handler(match, query, body))
+                self._send(404, {'error': f'{fake.name} has no route for {self.command} {url.path}'})
+
+            def _send(self, status, payload, headers=None):
+                content = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            do_GET = do_POST = do_PUT = do_PATCH = _handle
+
+        self._server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self._server.daemon_threads = True
+        threading.Thread(target=self._server.serve_forever, name=f'fake-{self.name}', daemon=True).start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+
+def site_name(i):
+    # zero padded, as PRTG matches groups by substring and Site 1 would also match Site 10
+    return f'Site {i:04d}'
+
+class Inventory:
+    '''Generated sites, each with a location, a Meraki AP, a probe device, a PI
+    and a Cradlepoint router, shared by every fake.
+    '''
+    def __init__(self, sites):
+        self.sites = []
+        self.cis = []
+        for i in range(1, sites + 1):
+            site = {
+                'sys_id': f'loc{i}',
+                'name': site_name(i),
+                'street': f'{i} Main St',
+                'city': 'Los Angeles',
+                'state': 'CA',
+                'zip': '90001',
+                'longitude': str(-118.2 - i * 0.001),
+                'latitude': str(34.0 + i * 0.001),
+                'sys_updated_on': '2022-01-01 00:00:00'
+            }
+            self.sites.append(site)
+            for kind, name, sys_class in (('ap', f'Meraki AP {i}', 'cmdb_ci_wap_network'),
+                                          ('probe', 'Probe Device', 'cmdb_ci_netgear')):
+                self.cis.append({
+                    'sys_id': f'{kind}{i}',
+                    'name': name,
+                    'sys_class_name': sys_class,
+                    'serial_number': f'Q2{kind.upper()}-{i:04d}',
+                    'mac_address': f'00:18:0a:00:{i // 256:02x}:{i % 256:02x}' if kind == 'ap' else '',
+                    'location': {'link': f'/api/now/table/cmn_location/loc{i}', 'value': f'loc{i}'},
+                    'location.name': site['name'],
+                    'manufacturer': {'link': '/api/now/table/core_company/cisco', 'value': 'cisco'},
+                    'manufacturer.name': 'Cisco',
+                    'warranty_expiration': '2030-01-01',
+                    'sys_updated_on': '2022-01-01 00:00:00'
+                })
+
+def _snow_filter(query):
+    '''Parses the encoded queries pysnow sends (a=b^c=d^ORc=e, fieldISEMPTY, field>value).'''
+    groups = []
+    for token in query.split('^') if query else []:
+        alternative = token.startswith('OR')
+        token = token[2:] if alternative else token
+        if token.startswith('ORDERBY') or not token:
+            continue
+        condition = re.fullmatch(r'([\w.]+?)(ISEMPTY|>=|<=|!=|=|>|<)(.*)', token)
+        if condition is None:
+            continue
+        if alternative and groups:
+            groups[-1].append(condition.groups())
+        else:
+            groups.append([condition.groups()])
+
+    def test(record, field, op, value):
+        actual = record.get(field, '')
+        if isinstance(actual, dict):
+            actual = actual.get('value', '')
+        return {'ISEMPTY': lambda: not actual, '=': lambda: actual == value, '!=': lambda: actual != value,
+                '>': lambda: actual > value, '>=': lambda: actual >= value,
+                '<': lambda: actual < value, '<=': lambda: actual <= value}[op]()
+
+    return lambda record: all(any(test(record, *c) for c in group) for group in groups)
+
+def _snow_page(records, query):
+    matched = [r for r in records if _snow_filter(query.get('sysparm_query', ''))(r)]
+    offset = int(query.get('sysparm_offset', 0))
+    limit = int(query.get('sysparm_limit', 10000))
+    page = matched[offset:offset + limit]
+    fields = [f for f in query.get('sysparm_fields', '').split(',') if f]
+    if fields:
+        page = [{f: r.get(f, '') for f in fields} for r in page]
+    page = [{k: dict(v) if isinstance(v, dict) else v for k, v in r.items()} for r in page]
+    return 200, {'result': page}
+
+def build(inventory, latency=None, jitter=None, error_rate=None):
+    '''Creates (not started) fakes of every upstream. latency, jitter and
+    error_rate map upstream names to values, with 'default' as fallback.
+    '''
+    latency = latency or {}
+    jitter = jitter or {}
+    error_rate = error_rate or {}
+    snow_records = {'cmn_location': inventory.sites, 'cmdb_ci': inventory.cis}
+    routers = [{'name': site['name'], 'state': 'online'} for site in inventory.sites]
+
+    def prtg_table(match, query, body):
+        sensors = []
+        for site in inventory.sites:
+            sensors.append({'objid': len(sensors) + 1, 'group': site['name'], 'device': 'PI - LTE', 'name': 'Ping', 'status': 'Up'})
+            sensors.append({'objid': len(sensors) + 1, 'group': site['name'], 'device': 'Probe Device', 'name': 'Probe Health', 'status': 'Up'})
+        group = query.get('filter_group', '')
+        group = group[5:-1] if group.startswith('@sub(') else group
+        sensors = [s for s in sensors
+                   if query.get('filter_name', s['name']) == s['name']
+                   and query.get('filter_device', s['device']) == s['device']
+                   and group in s['group']]
+        start = int(query.get('start', 0))
+        count = int(query.get('count', 500))
+        return 200, {'treesize': len(sensors), 'sensors': sensors[start:start + count]}
+
+    def snow_table(match, query, body):
+        status, payload = _snow_page(snow_records.get(match.group(1), []), query)
+        # reference links are absolute in ServiceNow responses
+        for record in payload['result']:
+            for value in record.values():
+                if isinstance(value, dict) and value.get('link', '').startswith('/'):
+                    value['link'] = fakes['snow'].url + value['link']
+        return status, payload
+
+    def snow_record(match, query, body):
+        if match.group(1) == 'core_company':
+            return 200, {'result': {'sys_id': match.group(2), 'name': 'Cisco'}}
+        record = next((r for r in snow_records.get(match.group(1), []) if r['sys_id'] == match.group(2)), None)
+        return (200, {'result': record}) if record else (404, {'error': {'message': 'No Record found'}})
+
+    def snow_update(match, query, body):
+        status, payload = snow_record(match, query, body)
+        if status == 200:
+            payload['result'] = dict(payload['result'], **(body or {}))
+        return status, payload
+
+    def snow_create(match, query, body):
+        return 201, {'result': dict(body or {}, sys_id=uuid.uuid4().hex)}
+
+    def snow_batch(match, query, body):
+        return 200, {'batch_request_id': body.get('batch_request_id'),
+                     'serviced_requests': [{'id': r['id'], 'status_code': 200} for r in body.get('rest_requests', [])],
+                     'unserviced_requests': []}
+
+    def meraki_devices(match, query, body):
+        devices = [{'serial': ci['serial_number'], 'mac': ci['mac_address'], 'name': ci['name']}
+                   for ci in inventory.cis if ci['sys_class_name'] == 'cmdb_ci_wap_network']
+        if 'mac' in query:
+            devices = [d for d in devices if d['mac'] == query['mac'].lower()]
+        if 'name' in query:
+            devices = [d for d in devices if d['name'] == query['name']]
+        return 200, devices
+
+    def meraki_statuses(match, query, body):
+        serials = query.get('serials[]')
+        serials = [serials] if isinstance(serials, str) else serials
+        statuses = [{'serial': ci['serial_number'], 'status': 'online'}
+                    for ci in inventory.cis if ci['sys_class_name'] == 'cmdb_ci_wap_network']
+        return 200, [s for s in statuses if not serials or s['serial'] in serials]
+
+    def netcloud_routers(match, query, body):
+        found = [r for r in routers if 'name' not in query or r['name'] == query['name']]
+        offset = int(query.get('offset', 0))
+        limit = int(query.get('limit', 20))
+        next_url = None
+        if offset + limit < len(found) and 'name' not in query:
+            next_url = f'{fakes["netcloud"].url}/routers/?fields=name,state&limit={limit}&offset={offset + limit}'
+        return 200, {'data': found[offset:offset + limit], 'meta': {'next': next_url, 'limit': limit, 'offset': offset}}
+
+    def gis_query(match, query, body):
+        return 200, {'features': [], 'exceededTransferLimit': False}
+
+    def geocode_find(match, query, body):
+        return 200, {'candidates': [{'address': query.get('SingleLine', ''), 'score': 100,
+                                     'location': {'x': -118.25, 'y': 34.05}}]}
+
+    def opsgenie_action(match, query, body):
+        return 202, {'result': 'Request will be processed', 'took': 0.01, 'requestId': uuid.uuid4().hex}
+
+    def cisco_coverage(match, query, body):
+        summaries = [{'sr_no': sn, 'warranty_end_date': '2030-01-01', 'is_covered': 'YES'}
+                     for sn in match.group(1).split(',') if sn]
+        return 200, {'serial_numbers': summaries, 'pagination_response_record': {'last_index': 1}}
+
+    routes = {
+        'prtg': [('GET', r'/api/table\.json', prtg_table),
+                 ('GET', r'/api/.*', lambda m, q, b: (200, {}))],
+        'snow': [('GET', r'/api/now/table/(\w+)', snow_table),
+                 ('GET', r'/api/now/table/(\w+)/(\w+)', snow_record),
+                 ('PUT', r'/api/now/table/(\w+)/(\w+)', snow_update),
+                 ('PATCH', r'/api/now/table/(\w+)/(\w+)', snow_update),
+                 ('POST', r'/api/now/table/(\w+)', snow_create),
+                 ('POST', r'/api/now/v1/batch', snow_batch)],
+        'meraki': [('GET', r'/api/v1/organizations', lambda m, q, b: (200, [{'id': '1', 'name': 'Meraki', 'url': ''}])),
+                   ('GET', r'/api/v1/organizations/(\w+)', lambda m, q, b: (200, {'id': m.group(1), 'name': 'Meraki', 'url': ''})),
+                   ('GET', r'/api/v1/organizations/\w+/devices', meraki_devices),
+                   ('GET', r'/api/v1/organizations/\w+/devices/statuses', meraki_statuses)],
+        'netcloud': [('GET', r'/routers/?', netcloud_routers)],
+        'gis': [('GET', r'/query', gis_query)],
+        'geocode': [('GET', r'/findAddressCandidates', geocode_find)],
+        'opsgenie': [('POST', r'/v2/alerts/[^/]+/(details|tags|close)', opsgenie_action)],
+        'cisco': [('GET', r'/sn2info/v2/coverage/summary/serial_numbers/(.*)', cisco_coverage)]
+    }
+    fakes = {name: FakeUpstream(name, routes[name],
+                                latency=latency.get(name, latency.get('default', 0.0)),
+                                jitter=jitter.get(name, jitter.get('default', 0.0)),
+                                error_rate=error_rate.get(name, error_rate.get('default', 0.0)))
+             for name in UPSTREAMS}
+    return fakes
+
+def point_config(config, fakes):
+    '''Points every upstream in an ADARCA config dict at the running fakes.'''
+    config['prtg']['url'] = fakes['prtg'].url
+    config['snow']['host'] = fakes['snow'].url.split('://', 1)[1]
+    config['snow']['use_ssl'] = False
+    config['meraki']['base_url'] = fakes['meraki'].url + '/api/v1'
+    config['meraki']['org_id'] = '1'
+    config['netcloud']['url'] = fakes['netcloud'].url
+    config['gis-api']['url'] = fakes['gis'].url + '/query'
+    config['geocode']['url'] = fakes['geocode'].url + '/findAddressCandidates'
+    config['opsgenie']['host'] = fakes['opsgenie'].url
+    config['cisco']['url'] = fakes['cisco'].url
+    return config
@@ -0,0 +1,257 @@
+'''Benchmarks ADARCA against local fake upstreams.
+
+Starts the fakes (see fakes.py), writes a config pointing every upstream at them,
+launches src/main.py with that config and drives its endpoints at a fixed
+concurrency. Reports latency percentiles and throughput per scenario, and can
+fail when results regress against a saved baseline.
+
+    python bench/run.py --sites 50 --requests 500 --concurrency 20 --latency 0.05
+    python bench/run.py --output baseline.json
+    python bench/run.py --baseline baseline.json --tolerance 0.2
+'''
+import argparse
+import copy
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent import futures
+from pathlib import Path
+
+import requests
+import yaml
+
+import fakes
+
+ROOT = Path(__file__).resolve().parent.parent
+SRC = ROOT / 'src'
+SCENARIOS = ('checkSiteOutage', 'checkWarranty', 'webhook')
+TOKEN = 'benchmark'
+
+def per_upstream(values):
+    '''Parses ['0.05', 'snow=0.2'] into {'default': 0.05, 'snow': 0.2}.'''
+    parsed = {}
+    for value in values or []:
+        name, _, number = value.rpartition('=')
+        parsed[name or 'default'] = float(number)
+    return parsed
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def merge(base, overrides):
+    for key, value in overrides.items():
+        if isinstance(value, dict) and isinstance(base.get(key), dict):
+            merge(base[key], value)
+        else:
+            base[key] = value
+    return base
+
+def write_config(path, upstreams, port, overrides):
+    with open(SRC / 'config.yaml.example') as f:
+        config = yaml.safe_load(f)
+    config['web'].update({'token': TOKEN, 'host': '127.0.0.1', 'port': port, 'log_level': 'warning'})
+    config['logger'] = {'console': {'log_level': 'warning'}}
+    # keep runs independent of each other
+    config['geocode'].pop('cache', None)
+    if config['jobs'].get('journal'):
+        config['jobs']['journal']['path'] = str(Path(path).with_name('jobs.db'))
+    if config['checks'].get('store'):
+        config['checks']['store']['path'] = str(Path(path).with_name('results.db'))
+    # long-running benchmarks should not trip the webhook queue limit
+    config['jobs']['max_queue'] = 100000
+    fakes.point_config(config, upstreams)
+    merge(config, overrides)
+    if config.get('cache', {}).get('backend') == 'sqlite':
+        config['cache']['path'] = str(Path(path).with_name('cache.db'))
+    with open(path, 'w') as f:
+        yaml.safe_dump(config, f)
+    return config
+
+def log_tail(log, lines=20):
+    log.flush()
+    with open(log.name) as f:
+        return ''.join(f.readlines()[-lines:])
+
+def start_app(config_path, port, log):
+    env = dict(os.environ, ADARCA_CONFIG=str(config_path))
+    process = subprocess.Popen([sys.executable, 'main.py'], cwd=SRC, env=env, stdout=log, stderr=subprocess.STDOUT)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'ADARCA exited with code {process.returncode}:\n{log_tail(log)}')
+        try:
+            requests.get(f'http://127.0.0.1:{port}/docs', timeout=1)
+            return process
+        except requests.ConnectionError:
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError(f'ADARCA did not start within 60 seconds:\n{log_tail(log)}')
+
+def alert(site, device):
+    alert_id = str(uuid.uuid4())
+    return {
+        'alert': {
+            'count': '1',
+            'description': f'Probe Health sensor of {device} is down.',
+            'extraProperties': {'sensorId': '1', 'group': site, 'device': device},
+            'source': 'PRTG',
+            'message': f'{site} {device} Probe Health down',
+            'priority': 'P3',
+            'tags': [],
+            'tinyId': '1',
+            'alias': alert_id,
+            'id': alert_id,
+            'actions': [],
+            'entity': site,
+            'status': 'open'
+        },
+        'customerName': 'benchmark',
+        'timestamp': str(int(time.time() * 1000)),
+        'actionSource': {'type': 'integration', 'source': 'benchmark'},
+        'actionName': 'ADARCA'
+    }
+
+def make_request(scenario, base_url, session, site, wait_jobs):
+    '''Runs one request of a scenario. Returns (seconds, ok).'''
+    start = time.perf_counter()
+    if scenario == 'checkSiteOutage':
+        response = session.get(f'{base_url}/checkSiteOutage', params={'site_name': site})
+        ok = response.status_code == 200
+    elif scenario == 'checkWarranty':
+        response = session.get(f'{base_url}/checkWarranty', params={'name': 'Probe Device', 'site_name': site})
+        ok = response.status_code == 200
+    else:
+        response = session.post(f'{base_url}/webhook/ops', json=alert(site, 'Probe Device'))
+        ok = response.status_code == 202
+        if ok and wait_jobs:
+            job_id = response.json()['job_id']
+            while True:
+                job = session.get(f'{base_url}/jobs/{job_id}').json()
+                if job['status'] in ('succeeded', 'failed'):
+                    ok = job['status'] == 'succeeded'
+                    break
+                time.sleep(0.01)
+    return time.perf_counter() - start, ok
+
+def percentile(values, p):
+    '''Nearest-rank percentile of sorted values.'''
+    if not values:
+        return None
+    rank = max(int(round(p / 100 * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+def run_scenario(scenario, base_url, sites, total, concurrency, wait_jobs):
+    local = threading.local()
+
+    def one(i):
+        if not hasattr(local, 'session'):
+            local.session = requests.Session()
+            local.session.headers['X-API-Key'] = TOKEN
+        try:
+            return make_request(scenario, base_url, local.session, fakes.site_name(i % sites + 1), wait_jobs)
+        except requests.RequestException:
+            return None, False
+
+    start = time.perf_counter()
+    with futures.ThreadPoolExecutor(concurrency) as executor:
+        results = list(executor.map(one, range(total)))
+    elapsed = time.perf_counter() - start
+    latencies = sorted(seconds for seconds, ok in results if ok)
+    return {
+        'requests': total,
+        'errors': sum(1 for _, ok in results if not ok),
+        'rps': round(total / elapsed, 2),
+        'p50': percentile(latencies, 50),
+        'p95': percentile(latencies, 95),
+        'p99': percentile(latencies, 99)
+    }
+
+def regressions(results, baseline, tolerance):
+    '''Lists scenarios whose p95 grew, or rps fell, by more than tolerance.'''
+    found = []
+    for scenario, result in results.items():
+        before = baseline.get(scenario)
+        if not before:
+            continue
+        if before.get('p95') and result['p95'] and result['p95'] > before['p95'] * (1 + tolerance):
+            found.append(f'{scenario}: p95 {result["p95"]:.3f}s > baseline {before["p95"]:.3f}s')
+        if before.get('rps') and result['rps'] < before['rps'] * (1 - tolerance):
+            found.append(f'{scenario}: {result["rps"]} rps < baseline {before["rps"]} rps')
+        if result['errors'] > before.get('errors', 0):
+            found.append(f'{scenario}: {result["errors"]} errors > baseline {before.get("errors", 0)}')
+    return found
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sites', type=int, default=50, help='sites in the fake inventory')
+    parser.add_argument('--requests', type=int, default=200, help='requests per scenario')
+    parser.add_argument('--concurrency', type=int, default=10, help='requests in flight at once')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS), help=f'comma separated, of: {", ".join(SCENARIOS)}')
+    parser.add_argument('--warmup', type=int, default=0, help='requests per scenario sent before measuring')
+    parser.add_argument('--latency', nargs='*', default=['0.05'], metavar='[UPSTREAM=]SECONDS',
+                        help=f'added upstream latency, upstreams: {", ".join(fakes.UPSTREAMS)}')
+    parser.add_argument('--jitter', nargs='*', default=['0.01'], metavar='[UPSTREAM=]SECONDS')
+    parser.add_argument('--error-rate', nargs='*', default=[], metavar='[UPSTREAM=]SHARE',
+                        help='share of upstream requests answered with 503')
+    parser.add_argument('--config', help='YAML merged over the generated ADARCA config, e.g. to turn on snapshots')
+    parser.add_argument('--no-wait-jobs', dest='wait_jobs', action='store_false',
+                        help='time webhooks until accepted instead of until their job finishes')
+    parser.add_argument('--output', help='write results as JSON to this file')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed regression against the baseline')
+    args = parser.parse_args()
+
+    overrides = {}
+    if args.config:
+        with open(args.config) as f:
+            overrides = yaml.safe_load(f) or {}
+    inventory = fakes.Inventory(args.sites)
+    upstreams = fakes.build(inventory, per_upstream(args.latency), per_upstream(args.jitter), per_upstream(args.error_rate))
+    for upstream in upstreams.values():
+        upstream.start()
+    port = free_port()
+    base_url = f'http://127.0.0.1:{port}'
+    with tempfile.TemporaryDirectory() as tmp:
+        config_path = Path(tmp) / 'config.yaml'
+        write_config(config_path, upstreams, port, copy.deepcopy(overrides))
+        with open(Path(tmp) / 'adarca.log', 'w') as log:
+            app = start_app(config_path, port, log)
+            try:
+                results = {}
+                for scenario in args.scenarios.split(','):
+                    if args.warmup:
+                        run_scenario(scenario, base_url, args.sites, args.warmup, args.concurrency, args.wait_jobs)
+                    results[scenario] = run_scenario(scenario, base_url, args.sites, args.requests,
+                                                     args.concurrency, args.wait_jobs)
+                    print(f'{scenario:16} {json.dumps(results[scenario])}')
+            finally:
+                app.terminate()
+                app.wait(30)
+                for upstream in upstreams.values():
+                    upstream.stop()
+            if any(result['errors'] for result in results.values()):
+                print('Some requests failed. Last lines of the ADARCA log:', file=sys.stderr)
+                print(log_tail(log), file=sys.stderr)
+    print('upstream requests ' + json.dumps({name: u.requests for name, u in upstreams.items()}))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(results, json.load(f), args.tolerance)
+        for regression in found:
+            print('REGRESSION ' + regression, file=sys.stderr)
+        if found:
+            sys.exit(1)
+
+if __name__ == '__main__':
+    main()
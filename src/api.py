@@ -1,15 +1,36 @@
 import json
+import os
 import secrets
-import textwrap
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
 
 import tweepy
-from fastapi import Depends, FastAPI, HTTPException, Security, status
+from fastapi import Depends, FastAPI, HTTPException, Request, Response, Security, status
+from fastapi.responses import JSONResponse, StreamingResponse
 from fastapi.security import APIKeyHeader
 from loguru import logger
-from prtg import PrtgApi
+from prometheus_client import CONTENT_TYPE_LATEST
+from starlette.routing import Match
 
+import cache
 import checks
+import breaker
+import clients
+import deadline
+import effects
 import geocode
+import jobs
+import journal
+import metrics
+import notify
+import periodic
+import provider
+import results
+import sensors
+import sweep
+import transport
+import warranty
 from config import config
 # replace SupportApi in production
 # from cisco.support import SupportApi
@@ -19,16 +40,40 @@ from netcloud import NetCloudApi
 from opsgenie import OpsgenieApi, OpsgenieRequest
 from opsgenie_sdk.exceptions import ConfigurationException
 from pysnow.exceptions import NoResults
-from snow import SnowApi
+from snow import CmdbMirror, SnowApi
 
 TOKEN = config['web']['token']
 
-PRTG_API = PrtgApi(config['prtg']['url'], 
-                   config['prtg']['username'], 
-                   config['prtg']['password'], 
-                   is_passhash=config['prtg'].get('is_passhash', False))
+# caches created by cache.create() are shared by every worker process with a shared backend, e.g. sqlite
+CACHE_CONFIG = config.get('cache', {})
+SHARED_CACHE = CACHE_CONFIG.get('backend', 'memory') != 'memory'
+# single-run work, e.g. the warranty sweep, runs in the worker that takes its lease first
+LEASES = cache.create('leases', maxsize=64, settings=CACHE_CONFIG)
+# provider outages, and their sites, already tweeted by any worker
+DIGESTS_SENT = cache.create('outage_digests', maxsize=8192, ttl=6*60*60, settings=CACHE_CONFIG)
+# upstream snapshots refreshed by one worker and loaded by the others, see _refresh_snapshot()
+SNAPSHOTS = cache.create('snapshots', maxsize=16, settings=CACHE_CONFIG) if SHARED_CACHE else None
 
-OPSGENIE_API = OpsgenieApi(config['opsgenie']['api_key'])
+# clients whose constructor calls their upstream are created in the background on startup, see /ready
+CLIENTS_CONFIG = config.get('clients', {})
+CLIENTS = clients.Registry()
+PRTG_API = CLIENTS.lazy('prtg',
+                        # through the shared session, whose timeout frees probe threads waiting on PRTG
+                        lambda: sensors.SessionPrtgApi(config['prtg']['url'], 
+                                                       config['prtg']['username'], 
+                                                       config['prtg']['password'], 
+                                                       session=transport.get_session('prtg'),
+                                                       is_passhash=config['prtg'].get('is_passhash', False)),
+                        retry_interval=CLIENTS_CONFIG.get('retry_interval', 30))
+# sensor lookups, served from a periodically pulled sensor table when configured
+PRTG_SNAPSHOT = config['prtg'].get('snapshot', {})
+PRTG_SENSORS = sensors.SensorSnapshot(PRTG_API,
+                                      session=transport.get_session('prtg'),
+                                      page_size=PRTG_SNAPSHOT.get('page_size', 2500),
+                                      max_age=PRTG_SNAPSHOT.get('max_age', 120)) if PRTG_SNAPSHOT else PRTG_API
+
+OPSGENIE_API = CLIENTS.add('opsgenie', OpsgenieApi(config['opsgenie']['api_key'], host=config['opsgenie'].get('host', None),
+                                                    timeout=config['opsgenie'].get('timeout', 30)))
 OPS_TO_SNOW_SEVERITY = {
     5: 3,
     4: 3,
@@ -40,30 +85,261 @@ OPS_TO_SNOW_SEVERITY = {
 
 SNOW_API = SnowApi(config['snow']['instance'], 
                    config['snow']['username'], 
-                   config['snow']['password'])
+                   config['snow']['password'],
+                   session=transport.get_session('snow'),
+                   host=config['snow'].get('host', None),
+                   use_ssl=config['snow'].get('use_ssl', True),
+                   record_cache=cache.create('snow_records',
+                                             maxsize=config['snow'].get('record_cache', {}).get('maxsize', 256),
+                                             ttl=config['snow'].get('record_cache', {}).get('ttl', 3600),
+                                             settings=CACHE_CONFIG),
+                   site_cache=cache.create('snow_sites',
+                                           maxsize=config['snow']['site_cache'].get('maxsize', 1024),
+                                           ttl=config['snow']['site_cache'].get('ttl', 300),
+                                           settings=CACHE_CONFIG) if 'site_cache' in config['snow'] else None)
+CLIENTS.add('snow', SNOW_API)
+# locations and CIs read by alerts, served from a periodically synced mirror when configured
+SNOW_MIRROR = config['snow'].get('mirror', {})
+if SNOW_MIRROR:
+    SNOW_API.mirror = CmdbMirror(SNOW_API,
+                                 page_size=SNOW_MIRROR.get('page_size', 1000),
+                                 max_age=SNOW_MIRROR.get('max_age', 900),
+                                 full_interval=SNOW_MIRROR.get('full_interval', 24*60*60))
 SNOW_COMPANY = config['snow']['company']
 SNOW_CALLER = config['snow']['caller']
 SNOW_OPENED_BY = config['snow']['opened_by']
 
-MERAKI_API = MerakiOrgApi(api_key=config['meraki']['api_key'], 
-                          org_id=config['meraki'].get('org_id', None), 
-                          org_name=config['meraki'].get('org_name', None))
+MERAKI_SNAPSHOT = config['meraki'].get('snapshot', {})
+MERAKI_API = CLIENTS.lazy('meraki',
+                          lambda: MerakiOrgApi(api_key=config['meraki']['api_key'], 
+                                               org_id=config['meraki'].get('org_id', None), 
+                                               org_name=config['meraki'].get('org_name', None),
+                                               snapshot_max_age=MERAKI_SNAPSHOT.get('max_age', None),
+                                               base_url=config['meraki'].get('base_url', 'https://api.meraki.com/api/v1'),
+                                               timeout=config['meraki'].get('timeout', 60)),
+                          on_ready=lambda meraki_api: breaker.guard(
+                              metrics.instrument(meraki_api.db.organizations, 'meraki',
+                                                 ['getOrganizationDevices', 'getOrganizationDevicesStatuses']),
+                              transport.circuit('meraki'), ['getOrganizationDevices', 'getOrganizationDevicesStatuses']),
+                          retry_interval=CLIENTS_CONFIG.get('retry_interval', 30))
 
+NETCLOUD_INVENTORY = config['netcloud'].get('inventory', {})
 NETCLOUD_API = NetCloudApi(config['netcloud']['url'], 
                            config['netcloud']['cp_id'], 
                            config['netcloud']['cp_key'], 
                            config['netcloud']['ecm_id'], 
-                           config['netcloud']['ecm_key'])
+                           config['netcloud']['ecm_key'],
+                           session=transport.get_session('netcloud'),
+                           inventory_max_age=NETCLOUD_INVENTORY.get('max_age', None),
+                           page_size=NETCLOUD_INVENTORY.get('page_size', 500))
+CLIENTS.add('netcloud', NETCLOUD_API)
 
 TWITTER_CLIENT = tweepy.Client(consumer_key=config['twitter']['conskey'],
                                consumer_secret=config['twitter']['conssec'],
                                access_token=config['twitter']['acctoken'],
                                access_token_secret=config['twitter']['tokensec'])
+CLIENTS.add('twitter', TWITTER_CLIENT)
+# outages are tweeted as one digest per provider outage, from a background thread
+DIGEST_CONFIG = config['twitter'].get('digest', {})
+OUTAGE_DIGEST = notify.OutageDigest(lambda text: TWITTER_CLIENT.create_tweet(text=text),
+                                    window=DIGEST_CONFIG.get('window', 60),
+                                    rate=DIGEST_CONFIG.get('per_minute', 5) / 60,
+                                    burst=DIGEST_CONFIG.get('burst', 5),
+                                    claim=lambda key: DIGESTS_SENT.add(key, os.getpid(),
+                                                                       ttl=DIGEST_CONFIG.get('repeat_after', 6*60*60)),
+                                    rate_limited=(tweepy.errors.TooManyRequests,))
 # replace SupportApi in production
 SIM_CISCO_SUPPORT_API = SimulatedSupportApi()
 
+# coverage of Cisco CIs, filled by the warranty sweep
+WARRANTY_SWEEP_CONFIG = config['cisco'].get('sweep', {})
+COVERAGE_CACHE = cache.create('warranty_coverage',
+                              maxsize=WARRANTY_SWEEP_CONFIG.get('maxsize', 100000),
+                              ttl=WARRANTY_SWEEP_CONFIG.get('ttl', 2*24*60*60),
+                              settings=CACHE_CONFIG)
+WARRANTY_SWEEP = warranty.WarrantySweep(SNOW_API, SIM_CISCO_SUPPORT_API, COVERAGE_CACHE,
+                                        batch_size=WARRANTY_SWEEP_CONFIG.get('batch_size', 75),
+                                        page_size=WARRANTY_SWEEP_CONFIG.get('page_size', 1000))
+
+# fan out outage check probes when enabled
+CHECKS_CONFIG = config.get('checks', {})
+PROBE_EXECUTOR = ThreadPoolExecutor(max_workers=CHECKS_CONFIG.get('workers', 16), thread_name_prefix='probe') \
+    if CHECKS_CONFIG.get('concurrent', False) else None
+PROBE_TIMEOUTS = CHECKS_CONFIG.get('timeouts', {})
+# seconds a /checkSiteOutage or /checkWarranty request, or a site of a sweep, may take with all its upstream calls
+CHECKS_BUDGET = CHECKS_CONFIG.get('budget', 30)
+# share one evaluation between concurrent checks of the same site or CI, finished ones across workers
+CHECKS_REUSE = CHECKS_CONFIG.get('reuse', 0)
+SITE_CHECKS = cache.SingleFlight(reuse=CHECKS_REUSE, results=cache.create(
+    'site_checks', ttl=CHECKS_REUSE, settings=CACHE_CONFIG) if CHECKS_REUSE else None)
+WARRANTY_CHECKS = cache.SingleFlight(reuse=CHECKS_REUSE, results=cache.create(
+    'warranty_checks', ttl=CHECKS_REUSE, settings=CACHE_CONFIG) if CHECKS_REUSE else None)
+
+# history of check results, reused by later checks when recent enough, see /siteHistory and /outageTimeline
+RESULTS_CONFIG = CHECKS_CONFIG.get('store')
+RESULTS = results.ResultStore(RESULTS_CONFIG['path'],
+                              retention=RESULTS_CONFIG.get('retention', 30*24*60*60)) if RESULTS_CONFIG else None
+
+# bulk site checks, see /sweepSiteOutage
+SWEEP_CONFIG = CHECKS_CONFIG.get('sweep', {})
+SWEEP_BATCH_SIZE = 100
+
+JOBS_CONFIG = config.get('jobs', {})
+JOB_QUEUE = jobs.JobQueue(workers=JOBS_CONFIG.get('workers', 4),
+                          max_size=JOBS_CONFIG.get('max_queue', 100),
+                          retention=JOBS_CONFIG.get('retention', 3600),
+                          # job statuses are only published when another worker process can read them
+                          store=cache.create('jobs', maxsize=JOBS_CONFIG.get('max_queue', 100) * 100,
+                                             ttl=JOBS_CONFIG.get('retention', 3600),
+                                             settings=CACHE_CONFIG) if SHARED_CACHE else None)
+# seconds an alert may take in total, its checks and side effects included
+ALERT_BUDGET = JOBS_CONFIG.get('budget', 60)
+# completed steps of each alert, so retries are not processed twice and restarts resume
+JOURNAL_CONFIG = JOBS_CONFIG.get('journal')
+JOURNAL = journal.Journal(JOURNAL_CONFIG['path'],
+                          retention=JOURNAL_CONFIG.get('retention', 7*24*60*60)) if JOURNAL_CONFIG else None
+# run independent side effects of an alert (tags, details, incident, tweet) at the same time
+ACTIONS_CONFIG = JOBS_CONFIG.get('actions', {})
+ACTION_EXECUTOR = ThreadPoolExecutor(max_workers=ACTIONS_CONFIG.get('workers', 8), thread_name_prefix='action') \
+    if ACTIONS_CONFIG.get('concurrent', False) else None
+
+# upstream, check, queue and cache metrics (HTTP clients in transport report their own)
+metrics.instrument(OPSGENIE_API, 'opsgenie', ['add_alert_details', 'add_alert_tags', 'close_alert'])
+metrics.instrument(TWITTER_CLIENT, 'twitter', ['create_tweet'])
+metrics.instrument_module(checks, ['check_outage', 'check_warranty', '_check_provider', '_check_pi',
+                                   '_check_probe', '_check_meraki', '_check_cradlepoint'])
+metrics.gauge('adarca_job_queue_size', 'Webhook jobs waiting for a worker.', lambda: JOB_QUEUE.size)
+metrics.gauge('adarca_job_workers_busy', 'Job workers running a webhook job.', lambda: JOB_QUEUE.busy)
+metrics.gauge('adarca_outage_digests_pending', 'Outage digests waiting to be tweeted.', lambda: OUTAGE_DIGEST.pending)
+metrics.gauge('adarca_probe_queue_size', 'Outage check probes waiting for a thread.',
+              lambda: PROBE_EXECUTOR._work_queue.qsize() if PROBE_EXECUTOR else 0)
+metrics.gauge('adarca_checks_coalesced', 'Site and warranty checks that shared a running evaluation.',
+              lambda: SITE_CHECKS.coalesced + WARRANTY_CHECKS.coalesced)
+metrics.register_cache('snow_records', SNOW_API.record_cache)
+metrics.register_cache('warranty_coverage', COVERAGE_CACHE)
+if SNOW_API.site_cache is not None:
+    metrics.register_cache('snow_sites', SNOW_API.site_cache)
+if geocode.CACHE is not None:
+    metrics.register_cache('geocode', geocode.CACHE)
+for name, checks_flight in (('site_checks', SITE_CHECKS), ('warranty_checks', WARRANTY_CHECKS)):
+    if checks_flight.results is not None:
+        metrics.register_cache(name, checks_flight.results)
+
+def _refresh_snapshot(name, interval, refresh, snapshot):
+    '''Refreshes a snapshot and publishes it, unless another worker process
+    refreshed it in the last half interval, in which case its copy is loaded.
+    A worker refreshes its own snapshot while no copy is published, e.g. on startup.
+    '''
+    if LEASES.add(name, os.getpid(), ttl=interval / 2):
+        refresh()
+        SNAPSHOTS.set(name, snapshot.export_state(), ttl=interval * 3)
+        return
+    state = SNAPSHOTS.get(name)
+    if state is None:
+        logger.debug(f'No {name} published by another worker yet, refreshing it.')
+        refresh()
+        return
+    snapshot.load_state(state)
+
+def _snapshot_task(name, interval, refresh, snapshot):
+    '''Returns the periodic refresh of a snapshot. Workers sharing a cache
+    backend refresh it once between them, see _refresh_snapshot().
+    '''
+    if SNAPSHOTS is None:
+        return periodic.PeriodicTask(name, interval, refresh)
+    return periodic.PeriodicTask(name, interval, lambda: _refresh_snapshot(name, interval, refresh, snapshot))
+
+# background refreshes of upstream snapshots
+PERIODIC_TASKS = []
+if PRTG_SNAPSHOT.get('interval'):
+    PERIODIC_TASKS.append(_snapshot_task('prtg-snapshot', PRTG_SNAPSHOT['interval'], PRTG_SENSORS.refresh, PRTG_SENSORS))
+if SNOW_API.mirror is not None and SNOW_MIRROR.get('interval'):
+    PERIODIC_TASKS.append(_snapshot_task('cmdb-mirror', SNOW_MIRROR['interval'], SNOW_API.mirror.sync, SNOW_API.mirror))
+if MERAKI_SNAPSHOT.get('interval'):
+    PERIODIC_TASKS.append(_snapshot_task('meraki-snapshot', MERAKI_SNAPSHOT['interval'], lambda: MERAKI_API.refresh_snapshot(), MERAKI_API))
+if provider.INDEX is not None:
+    PERIODIC_TASKS.append(_snapshot_task('gis-outage-index', provider.INDEX_CONFIG.get('interval', 300), provider.INDEX.refresh, provider.INDEX))
+if NETCLOUD_INVENTORY.get('interval'):
+    PERIODIC_TASKS.append(_snapshot_task('netcloud-inventory', NETCLOUD_INVENTORY['interval'], NETCLOUD_API.refresh_inventory, NETCLOUD_API))
+if metrics.MULTIPROCESS:
+    PERIODIC_TASKS.append(periodic.PeriodicTask('metrics-sample', config.get('metrics', {}).get('sample_interval', 5), metrics.sample))
+if RESULTS is not None:
+    PERIODIC_TASKS.append(periodic.PeriodicTask('result-store-prune', 60*60, RESULTS.prune))
+if WARRANTY_SWEEP_CONFIG.get('interval'):
+    PERIODIC_TASKS.append(periodic.PeriodicTask('warranty-sweep', WARRANTY_SWEEP_CONFIG['interval'],
+                                                lambda: _run_once('warranty-sweep', WARRANTY_SWEEP_CONFIG['interval'] / 2,
+                                                                  WARRANTY_SWEEP.run)))
+
+# snapshots a sweep refreshes once up front, when stale, instead of querying each site live
+SWEEP_WARMUPS = []
+if SNOW_API.mirror is not None:
+    SWEEP_WARMUPS.append(('cmdb-mirror', SNOW_API.mirror.is_fresh, SNOW_API.mirror.sync))
+if PRTG_SNAPSHOT:
+    SWEEP_WARMUPS.append(('prtg-snapshot', PRTG_SENSORS.is_fresh, PRTG_SENSORS.refresh))
+if MERAKI_SNAPSHOT.get('max_age'):
+    SWEEP_WARMUPS.append(('meraki-snapshot', lambda: MERAKI_API.snapshot_is_fresh(), lambda: MERAKI_API.refresh_snapshot()))
+if provider.INDEX is not None:
+    SWEEP_WARMUPS.append(('gis-outage-index', provider.INDEX.is_fresh, provider.INDEX.refresh))
+if NETCLOUD_INVENTORY.get('max_age'):
+    SWEEP_WARMUPS.append(('netcloud-inventory', NETCLOUD_API.inventory_is_fresh, NETCLOUD_API.refresh_inventory))
+
 app = FastAPI()
 
+def _run_once(name, lease, fn):
+    '''Runs fn unless another worker process ran it in the last lease seconds.'''
+    if not LEASES.add(name, os.getpid(), ttl=lease):
+        logger.debug(f'Skipping {name}, another worker ran it.')
+        return None
+    return fn()
+
+def _resume_alerts():
+    JOURNAL.prune()
+    for entry in JOURNAL.unfinished():
+        logger.info(f'Resuming interrupted alert {entry["alert_id"]}.')
+        try:
+            _submit_alert(OpsgenieRequest.parse_obj(entry['request']))
+        except jobs.QueueFull as e:
+            logger.error(f'Cannot resume alert {entry["alert_id"]}. {str(e)}')
+
+@app.on_event('startup')
+def start_workers():
+    if config['web'].get('workers', 1) > 1 and not SHARED_CACHE:
+        logger.warning('Running several workers with the memory cache backend, caches and job statuses are not shared.')
+    CLIENTS.start_all()
+    JOB_QUEUE.start()
+    OUTAGE_DIGEST.start()
+    if JOURNAL is not None:
+        # workers start together, one resumes the alerts
+        _run_once('journal-resume', 60, _resume_alerts)
+    for task in PERIODIC_TASKS:
+        task.start()
+
+@app.on_event('shutdown')
+def stop_workers():
+    for task in PERIODIC_TASKS:
+        task.stop()
+    JOB_QUEUE.stop(timeout=JOBS_CONFIG.get('shutdown_timeout', 30))
+    # after the jobs, which add outages to it
+    OUTAGE_DIGEST.stop(timeout=DIGEST_CONFIG.get('shutdown_timeout', 10))
+    metrics.mark_dead()
+
+@app.middleware('http')
+async def record_request_metrics(request: Request, call_next):
+    # label by route template rather than raw path to keep label values bounded
+    endpoint = next((route.path for route in request.app.router.routes
+                     if route.matches(request.scope)[0] == Match.FULL), 'unmatched')
+    with metrics.REQUEST_LATENCY.labels(request.method, endpoint).time():
+        response = await call_next(request)
+    metrics.REQUESTS.labels(request.method, endpoint, response.status_code).inc()
+    return response
+
+@app.exception_handler(breaker.CircuitOpen)
+@app.exception_handler(deadline.DeadlineExceeded)
+def upstream_unavailable(request: Request, e: Exception):
+    # e.g. the site lookup of a check hit a cut off upstream or ran out of time
+    logger.error(str(e))
+    return JSONResponse(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, content={'detail': str(e)})
+
 api_key = APIKeyHeader(name='X-API-Key')
 
 def authorize(key: str = Security(api_key)):
@@ -73,15 +349,26 @@ def authorize(key: str = Security(api_key)):
             detail='Invalid token')
 
 def _check_site_outage(site_name):
-    '''
+    '''Checks a site for power outages. Concurrent checks of the same site wait on
+    and share a single evaluation.
+
     Raises:
         pysnow.exceptions.NoResults: when site cannot be found
     '''
+    entry = _recent_result('outage', site_name)
+    if entry is not None:
+        return entry['details']
+    # within the budget of the caller, see _run_alert() and the endpoints
+    return SITE_CHECKS.do(site_name, _evaluate_site_outage, site_name)
+
+def _evaluate_site_outage(site_name):
     logger.info('Gathering site details...')
-    site = SNOW_API.get_site_by_name(site_name)
+    return _evaluate_site(SNOW_API.get_site_by_name(site_name))
+
+def _evaluate_site(site):
+    site_name = site['name']
     if not site['longitude'] or not site['latitude']:
-        address = ', '.join((site['street'], site['city'], site['state']))
-        address = ' '.join((address, site['zip']))
+        address = geocode.format_address(site)
         logger.info(f'Location is missing long/lat values. Geocoding address: {address}')
         try:
             long, lat = geocode.get_long_lat(address)
@@ -91,51 +378,142 @@ def _check_site_outage(site_name):
             logger.info('Updating record on SNOW CMDB...')
             site = SNOW_API.set_long_lat(site['sys_id'], long, lat)
     logger.info('Found site ' + site_name + '. Getting power status...')
-    return checks.check_outage(site, PRTG_API, MERAKI_API, SNOW_API, NETCLOUD_API)
+    details = checks.check_outage(site, PRTG_SENSORS, MERAKI_API, SNOW_API, NETCLOUD_API,
+                                  executor=PROBE_EXECUTOR, timeouts=PROBE_TIMEOUTS,
+                                  mode=CHECKS_CONFIG.get('mode', 'full'), costs=CHECKS_CONFIG.get('costs', {}))
+    if RESULTS is not None:
+        RESULTS.record('outage', site_name, details, verdict=details['Power_SitePower'])
+    return details
+
+def _recent_result(kind, site_name, subject=''):
+    '''Returns the stored result of a check younger than checks.store.max_age, or None.'''
+    if RESULTS is None or not RESULTS_CONFIG.get('max_age'):
+        return None
+    entry = RESULTS.recent(kind, site_name, RESULTS_CONFIG['max_age'], subject=subject)
+    if entry is not None:
+        logger.info(f'Reusing {kind} check of {subject or site_name} from {time.time() - entry["checked"]:.0f}s ago.')
+    return entry
+
+def _sweep_site(site):
+    '''Checks a site of a sweep, given as a location record or, when it was not
+    found in bulk, by name.
+    '''
+    # each site of a sweep gets a budget of its own
+    with deadline.limit(CHECKS_BUDGET):
+        if isinstance(site, str):
+            return _check_site_outage(site)
+        entry = _recent_result('outage', site['name'])
+        if entry is not None:
+            return entry['details']
+        return SITE_CHECKS.do(site['name'], _evaluate_site, site)
+
+def _resolve_sweep_sites(sweep_req):
+    '''Looks up the locations of a sweep in bulk. Returns (name, site) tuples.'''
+    filters = dict(sweep_req.filters)
+    if not sweep_req.site_names:
+        return [(site['name'], site) for site in SNOW_API.iter_sites_filtered_by(filters, fields=checks.SITE_FIELDS)]
+    names = list(dict.fromkeys(sweep_req.site_names))
+    found = {}
+    # keep each encoded query short enough for a URL
+    for start in range(0, len(names), SWEEP_BATCH_SIZE):
+        filters['name'] = names[start:start + SWEEP_BATCH_SIZE]
+        for site in SNOW_API.iter_sites_filtered_by(filters, fields=checks.SITE_FIELDS):
+            found[site['name']] = site
+    # names not found in bulk are looked up one by one, which reports missing sites
+    return [(name, found.get(name, name)) for name in names] if not sweep_req.filters else list(found.items())
 
 def _check_warranty(name, site_name):
+    entry = _recent_result('warranty', site_name, subject=name)
+    if entry is not None:
+        return entry['details']
+    return WARRANTY_CHECKS.do((name, site_name), _evaluate_warranty, name, site_name)
+
+def _evaluate_warranty(name, site_name):
     filter = {'name': [name], 'location.name': [site_name]}
-    ci = SNOW_API.get_cis_filtered_by(filter)[0]
+    ci = next(SNOW_API.iter_cis_filtered_by(filter, fields=checks.WARRANTY_CI_FIELDS, page_size=1), None)
+    if ci is None:
+        raise IndexError(f'Cannot find configuration item {name} at {site_name}.')
     logger.info(f'Found configuration item for {name} at {site_name}.')
-    return checks.check_warranty(ci, SIM_CISCO_SUPPORT_API, SNOW_API)
+    details = checks.check_warranty(ci, SIM_CISCO_SUPPORT_API, SNOW_API, coverage_cache=COVERAGE_CACHE)
+    if RESULTS is not None:
+        RESULTS.record('warranty', site_name, details, verdict='Expired' if details else None, subject=name)
+    return details
 
 @app.get('/checkSiteOutage', dependencies=[Depends(authorize)])
 def check_site_outage(site_name: str):
-    return _check_site_outage(site_name)
+    with deadline.limit(CHECKS_BUDGET):
+        return _check_site_outage(site_name)
 
 @app.get('/checkWarranty', dependencies=[Depends(authorize)])
 def check_warranty(name: str, site_name: str):
-    return _check_warranty(name, site_name)
+    with deadline.limit(CHECKS_BUDGET):
+        return _check_warranty(name, site_name)
 
-@app.post('/webhook/ops', dependencies=[Depends(authorize)])
-def webhook_ops(opsgenie_req: OpsgenieRequest):
-    logger.info(f'Alert "{opsgenie_req.alert.message}" triggered ADARCA.')
-    logger.debug(json.dumps(opsgenie_req.dict(), indent=2, sort_keys=True))
+def _result_store():
+    if RESULTS is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail='Check results are not stored, configure checks.store.')
+    return RESULTS
+
+@app.get('/siteHistory', dependencies=[Depends(authorize)])
+def site_history(site_name: str, kind: Optional[str] = None, since: Optional[float] = None,
+                 until: Optional[float] = None, limit: int = 100):
+    '''Returns the stored outage and warranty check results of a site, newest
+    first. since and until are Unix timestamps.
+    '''
+    return _result_store().history(site_name, kind=kind, since=since, until=until, limit=min(limit, 1000))
+
+@app.get('/outageTimeline', dependencies=[Depends(authorize)])
+def outage_timeline(site_name: str, since: Optional[float] = None, until: Optional[float] = None):
+    '''Returns the periods a site was up or down, from its stored outage checks.
+    since and until are Unix timestamps.
+    '''
+    return _result_store().timeline(site_name, since=since, until=until)
+
+@app.post('/sweepSiteOutage', dependencies=[Depends(authorize)])
+def sweep_site_outage(sweep_req: sweep.SweepRequest):
+    '''Checks many sites for power outages and streams one JSON line per site as it finishes.'''
+    if not sweep_req.site_names and not sweep_req.filters:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail='Give site_names or filters to select the sites to check.')
+    sites = _resolve_sweep_sites(sweep_req)
+    if len(sites) > SWEEP_CONFIG.get('max_sites', 1000):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f'{len(sites)} sites selected, at most {SWEEP_CONFIG.get("max_sites", 1000)} can be checked at once.')
+    logger.info(f'Sweeping {len(sites)} site(s) for power outages...')
+    return StreamingResponse(sweep.stream(sites, _sweep_site, SWEEP_WARMUPS, workers=SWEEP_CONFIG.get('workers', 8)),
+                             media_type='application/x-ndjson')
+
+def _process_alert(job, opsgenie_req):
+    '''Runs the ADARCA pipeline for an Opsgenie alert on a job queue worker.
+    '''
     site_name = opsgenie_req.alert.extra_properties.group
     device = opsgenie_req.alert.extra_properties.device
     alert_id = opsgenie_req.alert.id
     create_outage_incident = False
     logger.info(f'Beginning data collection for site {site_name}.')
+    job.progress('check_warranty')
     try:
         # check warranty
-        warranty_details = _check_warranty(device, site_name)
+        warranty_details = _step(alert_id, 'check_warranty', _check_warranty, device, site_name)
     except IndexError:
         logger.error('Unable to find configuration item. Cannot check warranty information.')
     else:
         if warranty_details:
-            logger.info('Creating expired warranty incident...')
+            job.progress('create_warranty_incident')
             # create warranty incident
-            incident = SNOW_API.create_incident(SNOW_COMPANY, SNOW_CALLER, SNOW_OPENED_BY,
-                    f'[ADARCA] Warranty of configuration item {device} is expired.',
-                    warranty_details,
-                    3,
-                    site_name,
-                    ci=device)
-        logger.info(f'Expired warranty incident created here: {SNOW_API.get_incident_link(incident["sys_id"])}.')
+            _step(alert_id, 'create_warranty_incident', _create_warranty_incident, device, warranty_details, site_name)
 
+    dispatcher = effects.Dispatcher(ACTION_EXECUTOR, progress=job.progress)
+    # actions that change the alert, which is closed only after them
+    alert_updates = []
+    job.progress('check_site_outage')
     try:
         # check power outage
-        details = _check_site_outage(site_name)
+        details = _step(alert_id, 'check_site_outage', _check_site_outage, site_name)
     except NoResults as e:
         logger.error(f'{str(e)}. Cannot check for power outages.')
     else:
@@ -146,52 +524,199 @@ def webhook_ops(opsgenie_req: OpsgenieRequest):
         opsgenie_req.alert.description = '\n'.join(('Power Check Details', extra_str, '', 'Alert Details', opsgenie_req.alert.description))
         if details['Power_SitePower'] == 'Down':
             # add tag for site down
-            logger.info('Adding outage tag to alert...')
-            try:
-                OPSGENIE_API.add_alert_tags(alert_id, ['SitePowerDown'], note=f'Automated action {opsgenie_req.action_name} detected site power is down. Tag has been added.')
-            except ConfigurationException as e:
-                logger.error(str(e))
+            dispatcher.add('add_alert_tags', _step, alert_id, 'add_alert_tags', _add_alert_tags, alert_id, opsgenie_req.action_name)
+            alert_updates.append('add_alert_tags')
             # set flag to create incident
             create_outage_incident = True
 
         # update alert with collected statuses
-        note = f'Automated action {opsgenie_req.action_name} completed. Details of collected statuses have been added as extra properties.'
-        logger.info('Adding collected status details to alert...')
-        try:
-            OPSGENIE_API.add_alert_details(alert_id, details, note=note)
-        except ConfigurationException as e:
-            logger.error(str(e))
+        dispatcher.add('add_alert_details', _step, alert_id, 'add_alert_details', _add_alert_details, alert_id, details, opsgenie_req.action_name)
+        alert_updates.append('add_alert_details')
     finally:
         ops_impact = int(opsgenie_req.alert.priority[1:]) - 1
         impact = OPS_TO_SNOW_SEVERITY[ops_impact]
-        logger.info('Forwarding alert to ITSM...')
         if create_outage_incident:
             # create power outage incident
-            incident = SNOW_API.create_incident(SNOW_COMPANY, SNOW_CALLER, SNOW_OPENED_BY,
-                    f'[ADARCA] Power outage detected for site {site_name}',
-                    opsgenie_req.alert.description,
-                    impact,
-                    site_name)
-            # notify power outage to external platform
-            logger.info('Tweeting outage details...')
-            try:
-                TWITTER_CLIENT.create_tweet(text=textwrap.dedent(f'''\
-                    OUTAGE DETECTED
-                    Start Date: {details['Power_StartDate']}
-                    Type: {details['Power_OutageType']}
-                    Cause: {details['Power_Cause']}
-                    Estimated Restore Date: {details['Power_EstimatedRestoreDate']}'''))
-            except tweepy.errors.Forbidden as e:
-                logger.error(str(e))          
+            dispatcher.add('create_incident', _step, alert_id, 'create_incident', _create_incident,
+                           f'[ADARCA] Power outage detected for site {site_name}',
+                           opsgenie_req.alert.description,
+                           impact,
+                           site_name)
+            # notify power outage to external platform, in a digest of all sites of the provider outage
+            dispatcher.add('queue_tweet', _step, alert_id, 'queue_tweet', _queue_tweet, site_name, details)
         else:
             # forward opsgenie alert to snow incident
-            incident = SNOW_API.create_incident(SNOW_COMPANY, SNOW_CALLER, SNOW_OPENED_BY,
-                    opsgenie_req.alert.message,
-                    opsgenie_req.alert.description,
-                    impact,
-                    site_name)
-        logger.info(f'Incident created at: {SNOW_API.get_incident_link(incident["sys_id"])}.')
-        logger.info('Closing alert on Opsgenie...')
-        OPSGENIE_API.close_alert(alert_id, source='python opsgenie-sdk/2.1.5', note='Alert closed by ADARCA.')
+            dispatcher.add('create_incident', _step, alert_id, 'create_incident', _create_incident,
+                           opsgenie_req.alert.message,
+                           opsgenie_req.alert.description,
+                           impact,
+                           site_name)
+        dispatcher.add('close_alert', _step, alert_id, 'close_alert', _close_alert, alert_id,
+                       after=alert_updates + ['create_incident'])
+        try:
+            outcomes = dispatcher.run()
+        except effects.ActionsFailed as e:
+            job.actions = _action_summary(e.outcomes)
+            raise
+        job.actions = _action_summary(outcomes)
         logger.info('ADARCA request complete!')
         return 'ADARCA request complete. Incident has been created and this alert will close.'
+
+def _run_alert(job, opsgenie_req):
+    '''Runs _process_alert and records in the journal how it ended.
+    '''
+    alert_id = opsgenie_req.alert.id
+    try:
+        # one budget for the checks and side effects of the alert, a retry resumes the steps it did not get to
+        with deadline.limit(ALERT_BUDGET):
+            result = _process_alert(job, opsgenie_req)
+    except Exception as e:
+        if JOURNAL is not None:
+            JOURNAL.finish(alert_id, error=str(e) or type(e).__name__)
+        raise
+    if JOURNAL is not None:
+        JOURNAL.finish(alert_id, result=result)
+    return result
+
+def _submit_alert(opsgenie_req, claim=False, replaces=None):
+    '''Queues an alert, recording it in the journal first so it resumes after a restart.
+    With claim, the alert is only queued if its journal claim succeeds (see
+    Journal.claim()), otherwise None is returned.
+
+    Raises:
+        jobs.QueueFull: when the job queue is full
+    '''
+    alert_id = opsgenie_req.alert.id
+    if JOURNAL is not None and claim:
+        if not JOURNAL.claim(alert_id, opsgenie_req.dict(by_alias=True), replaces):
+            return None
+    elif JOURNAL is not None:
+        JOURNAL.begin(alert_id, opsgenie_req.dict(by_alias=True))
+    try:
+        job = JOB_QUEUE.submit(_run_alert, opsgenie_req, name=alert_id)
+    except jobs.QueueFull as e:
+        if JOURNAL is not None:
+            JOURNAL.finish(alert_id, error=str(e))
+        raise
+    if JOURNAL is not None:
+        JOURNAL.assign(alert_id, job.id)
+    return job
+
+def _step(alert_id, name, fn, *args):
+    '''Runs a pipeline step of an alert, or returns its result recorded in the journal.
+
+    Raises:
+        deadline.DeadlineExceeded: when the budget of the alert is spent before the step runs
+    '''
+    def run(*args):
+        deadline.check(name)
+        return fn(*args)
+    if JOURNAL is None:
+        return run(*args)
+    return JOURNAL.step(alert_id, name, run, *args)
+
+def _create_warranty_incident(device, warranty_details, site_name):
+    logger.info('Creating expired warranty incident...')
+    incident = SNOW_API.create_incident(SNOW_COMPANY, SNOW_CALLER, SNOW_OPENED_BY,
+            f'[ADARCA] Warranty of configuration item {device} is expired.',
+            warranty_details,
+            3,
+            site_name,
+            ci=device)
+    logger.info(f'Expired warranty incident created here: {SNOW_API.get_incident_link(incident["sys_id"])}.')
+    return incident['sys_id']
+
+def _add_alert_tags(alert_id, action_name):
+    logger.info('Adding outage tag to alert...')
+    try:
+        OPSGENIE_API.add_alert_tags(alert_id, ['SitePowerDown'], note=f'Automated action {action_name} detected site power is down. Tag has been added.')
+    except ConfigurationException as e:
+        logger.error(str(e))
+
+def _add_alert_details(alert_id, details, action_name):
+    note = f'Automated action {action_name} completed. Details of collected statuses have been added as extra properties.'
+    logger.info('Adding collected status details to alert...')
+    try:
+        OPSGENIE_API.add_alert_details(alert_id, details, note=note)
+    except ConfigurationException as e:
+        logger.error(str(e))
+
+def _create_incident(message, description, impact, site_name):
+    logger.info('Forwarding alert to ITSM...')
+    incident = SNOW_API.create_incident(SNOW_COMPANY, SNOW_CALLER, SNOW_OPENED_BY, message, description, impact, site_name)
+    logger.info(f'Incident created at: {SNOW_API.get_incident_link(incident["sys_id"])}.')
+    return incident['sys_id']
+
+def _queue_tweet(site_name, details):
+    logger.info('Queueing outage details for the next tweet...')
+    OUTAGE_DIGEST.add(site_name, details)
+
+def _close_alert(alert_id):
+    logger.info('Closing alert on Opsgenie...')
+    OPSGENIE_API.close_alert(alert_id, source='python opsgenie-sdk/2.1.5', note='Alert closed by ADARCA.')
+
+def _action_summary(outcomes):
+    return {name: {'status': o['status'], 'error': o['error'], 'seconds': round(o['seconds'], 3)}
+            for name, o in outcomes.items()}
+
+@app.post('/webhook/ops', status_code=status.HTTP_202_ACCEPTED, dependencies=[Depends(authorize)])
+def webhook_ops(opsgenie_req: OpsgenieRequest):
+    logger.info(f'Alert "{opsgenie_req.alert.message}" triggered ADARCA.')
+    # rendered only when a sink logs debug messages
+    logger.opt(lazy=True).debug('{}', lambda: json.dumps(opsgenie_req.dict(), indent=2, sort_keys=True))
+    # Opsgenie retries callbacks, answer retries of known alerts from the journal
+    entry = JOURNAL.get(opsgenie_req.alert.id) if JOURNAL is not None else None
+    if entry is not None and entry['status'] == 'succeeded':
+        logger.info(f'Alert {opsgenie_req.alert.id} was already processed by job {entry["job_id"]}.')
+        return {'job_id': entry['job_id'], 'status': entry['status']}
+    replaces = None
+    if entry is not None and entry['status'] == 'running':
+        job = JOB_QUEUE.status(entry['job_id']) if entry['job_id'] else None
+        if job is not None and job['status'] in ('queued', 'running'):
+            logger.info(f'Alert {opsgenie_req.alert.id} is already being processed by job {job["id"]}.')
+            return {'job_id': job['id'], 'status': job['status']}
+        # the job was lost, take the alert over unless another retry does first
+        replaces = entry['job_id']
+    try:
+        # a retry arriving at another worker process at the same time claims the alert first
+        job = _submit_alert(opsgenie_req, claim=True, replaces=replaces)
+    except jobs.QueueFull as e:
+        logger.error(str(e))
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail='ADARCA is busy. Try again later.')
+    if job is None:
+        entry = JOURNAL.get(opsgenie_req.alert.id)
+        logger.info(f'Alert {opsgenie_req.alert.id} is already being processed by another worker.')
+        return {'job_id': entry['job_id'], 'status': entry['status']}
+    logger.info(f'Queued job {job.id} for alert {opsgenie_req.alert.id}.')
+    return {'job_id': job.id, 'status': job.status}
+
+@app.get('/jobs/{job_id}', dependencies=[Depends(authorize)])
+def get_job(job_id: str):
+    job = JOB_QUEUE.status(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f'Cannot find job {job_id}.')
+    return job
+
+@app.get('/ready')
+def get_ready(response: Response):
+    '''Reports the state of each upstream client: 503 while any is still being
+    created, 200 once all are ready or, when some failed, degraded. Also
+    reports the circuit breaker of each upstream.
+    '''
+    states = {name: {'state': s['state'], 'since': s['since']} for name, s in CLIENTS.status().items()}
+    if any(s['state'] in ('pending', 'starting') for s in states.values()):
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+        ready = 'starting'
+    elif all(s['state'] == 'ready' for s in states.values()):
+        ready = 'ready'
+    else:
+        ready = 'degraded'
+    return {'status': ready, 'clients': states, 'breakers': breaker.status()}
+
+@app.get('/metrics', dependencies=[] if config.get('metrics', {}).get('public', False) else [Depends(authorize)])
+def get_metrics():
+    return Response(content=metrics.generate(), media_type=CONTENT_TYPE_LATEST)
@@ -0,0 +1,53 @@
+'''Geocodes every SNOW location missing a longitude or latitude and writes the
+result back to the CMDB, so the webhook does not have to geocode on an alert.
+
+Usage:
+    python backfill.py [--batch-size 50] [--pause 1] [--dry-run]
+'''
+import argparse
+import time
+
+from loguru import logger
+
+import geocode
+import transport
+from config import config
+from snow import SnowApi
+
+def backfill(snow_api, batch_size=50, pause=1, dry_run=False):
+    sites = snow_api.get_sites_missing_long_lat(fields=['sys_id', 'name', 'street', 'city', 'state', 'zip'])
+    logger.info(f'Found {len(sites)} location(s) missing longitude/latitude.')
+    updated = failed = 0
+    for start in range(0, len(sites), batch_size):
+        batch = sites[start:start + batch_size]
+        logger.info(f'Geocoding locations {start + 1}-{start + len(batch)} of {len(sites)}...')
+        for site in batch:
+            address = geocode.format_address(site)
+            try:
+                long, lat = geocode.get_long_lat(address)
+            except (geocode.NoCandidateFound, geocode.LowScore) as e:
+                logger.warning(f'Failed to geocode {site["name"]} at {address}. Cause: {str(e)}')
+                failed += 1
+                continue
+            if not dry_run:
+                snow_api.set_long_lat(site['sys_id'], long, lat)
+            updated += 1
+        if start + batch_size < len(sites):
+            time.sleep(pause)
+    logger.info(f'Backfill complete: {updated} location(s) updated, {failed} could not be geocoded.')
+    return updated, failed
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Backfill missing SNOW location longitude/latitude.')
+    parser.add_argument('--batch-size', type=int, default=50, help='locations geocoded between pauses')
+    parser.add_argument('--pause', type=float, default=1, help='seconds to wait between batches')
+    parser.add_argument('--dry-run', action='store_true', help='geocode without updating SNOW')
+    args = parser.parse_args()
+
+    snow_api = SnowApi(config['snow']['instance'],
+                       config['snow']['username'],
+                       config['snow']['password'],
+                       session=transport.get_session('snow'),
+                       host=config['snow'].get('host', None),
+                       use_ssl=config['snow'].get('use_ssl', True))
+    backfill(snow_api, batch_size=args.batch_size, pause=args.pause, dry_run=args.dry_run)
@@ -0,0 +1,146 @@
+'''Circuit breakers for upstreams.
+
+After failures consecutive failed calls a breaker opens and calls to its
+upstream raise CircuitOpen right away. After reset_timeout seconds it lets
+half_open_calls trial calls through: a success closes it again, a failure
+opens it for another reset_timeout. Only failures of the upstream count,
+i.e. connection errors, timeouts and 5xx responses, not e.g. a 404.
+'''
+import functools
+import socket
+import threading
+import time
+
+import requests
+from loguru import logger
+
+class CircuitOpen(Exception):
+    pass
+
+# RetryError: 5xx responses still failing after the transport retries
+FAILURES = (requests.ConnectionError, requests.Timeout, requests.exceptions.RetryError, socket.timeout, ConnectionError)
+
+_breakers = {}
+_lock = threading.Lock()
+
+def is_failure(e):
+    '''Returns whether an error means the upstream is failing.'''
+    if isinstance(e, FAILURES):
+        return True
+    # e.g. meraki.APIError.status, requests.HTTPError.response
+    status = getattr(e, 'status', None)
+    if not isinstance(status, int):
+        status = getattr(getattr(e, 'response', None), 'status_code', None)
+    return isinstance(status, int) and status >= 500
+
+class CircuitBreaker:
+    '''Tracks failures of one upstream, see the module docstring.
+
+    Parameters
+    ----------
+    name : str
+        Upstream name, in errors and /ready.
+    failures : int
+        Consecutive failures that open the breaker.
+    reset_timeout : float
+        Seconds the breaker stays open before trial calls.
+    half_open_calls : int
+        Trial calls let through at the same time while half-open.
+    '''
+    def __init__(self, name, failures=5, reset_timeout=30, half_open_calls=1):
+        self.name = name
+        self.failures = failures
+        self.reset_timeout = reset_timeout
+        self.half_open_calls = half_open_calls
+        self.state = 'closed'
+        self._failed = 0
+        self._trials = 0
+        self._opened = None
+        self._lock = threading.Lock()
+
+    def before(self):
+        '''Call before each call to the upstream, then success(), failure() or release().
+
+        Raises:
+            CircuitOpen: when calls to the upstream are cut off
+        '''
+        with self._lock:
+            if self.state == 'open' and time.monotonic() - self._opened >= self.reset_timeout:
+                self.state = 'half-open'
+                self._trials = 0
+            if self.state == 'open' or (self.state == 'half-open' and self._trials >= self.half_open_calls):
+                raise CircuitOpen(f'{self.name} is cut off after {self._failed} failed call(s).')
+            if self.state == 'half-open':
+                self._trials += 1
+
+    def success(self):
+        with self._lock:
+            recovered = self.state != 'closed'
+            self.state = 'closed'
+            self._failed = 0
+            self._trials = 0
+        if recovered:
+            logger.info(f'{self.name} recovered, closing its circuit breaker.')
+
+    def failure(self):
+        with self._lock:
+            self._failed += 1
+            opening = self.state == 'half-open' or (self.state == 'closed' and self._failed >= self.failures)
+            if opening:
+                self.state = 'open'
+                self._opened = time.monotonic()
+        if opening:
+            logger.warning(f'{self.name} failed {self._failed} time(s), cutting it off for {self.reset_timeout}s.')
+
+    def release(self):
+        '''Ends a call that neither succeeded nor failed, e.g. one abandoned when the request budget ran out.'''
+        with self._lock:
+            if self.state == 'half-open' and self._trials:
+                self._trials -= 1
+
+    def call(self, fn, *args, **kwargs):
+        '''Returns fn(*args, **kwargs), recording whether it failed.
+
+        Raises:
+            CircuitOpen: when calls to the upstream are cut off
+        '''
+        self.before()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            # other errors, e.g. a 404, still mean the upstream answered
+            if is_failure(e):
+                self.failure()
+            else:
+                self.success()
+            raise
+        self.success()
+        return result
+
+    def status(self):
+        return {'state': self.state, 'failures': self._failed}
+
+def get(name, **options):
+    '''Returns the breaker of an upstream, creating it with options on first use.'''
+    with _lock:
+        if name not in _breakers:
+            _breakers[name] = CircuitBreaker(name, **options)
+        return _breakers[name]
+
+def guard(obj, circuit, methods):
+    '''Replaces methods of a client instance with versions called through circuit. Returns obj.'''
+    if circuit is None:
+        return obj
+    for method in methods:
+        setattr(obj, method, _guarded(circuit, getattr(obj, method)))
+    return obj
+
+def _guarded(circuit, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        return circuit.call(fn, *args, **kwargs)
+    return wrapper
+
+def status():
+    with _lock:
+        return {name: circuit.status() for name, circuit in _breakers.items()}
@@ -0,0 +1,273 @@
+'''In-process and shared caches.
+
+Caches implement get, set, add, delete, invalidate and clear, and count hits
+and misses. TTLCache lives in the memory of one process. SqliteCache keeps
+entries in a SQLite file, so every worker process of a multi-worker
+deployment shares them. create() returns a cache of the backend configured
+under 'cache' in config.yaml; other backends, e.g. one for a Redis-compatible
+server, can be added with register_backend().
+'''
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from copy import deepcopy
+
+import deadline
+
+_MISSING = object()
+
+class TTLCache:
+    '''Thread-safe LRU cache whose entries also expire ttl seconds after
+    they are set. Keeps hit and miss counts for reporting.
+
+    Parameters
+    ----------
+    maxsize : int
+        Number of entries kept before the least recently used is evicted.
+    ttl : float
+        Seconds an entry is served after it is set.
+    '''
+    def __init__(self, maxsize=1024, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, expires = self._data.get(key, (_MISSING, None))
+            if value is _MISSING or expires < time.monotonic():
+                if value is not _MISSING:
+                    del self._data[key]
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._data[key] = (value, time.monotonic() + (self.ttl if ttl is None else ttl))
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def add(self, key, value, ttl=None):
+        '''Sets key only if it has no live entry. Returns whether it was set.'''
+        with self._lock:
+            _, expires = self._data.get(key, (_MISSING, None))
+            if expires is not None and expires >= time.monotonic():
+                return False
+        self.set(key, value, ttl)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def invalidate(self, predicate):
+        '''Removes every entry whose key matches predicate(key).'''
+        with self._lock:
+            for key in [key for key in self._data if predicate(key)]:
+                del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        return len(self._data)
+
+class SqliteCache:
+    '''Cache kept in a SQLite file, shared by every process that opens it.
+
+    Several caches can share one file, each under its own namespace. Keys and
+    values are pickled. Entries expire ttl seconds after they are set; when
+    more than maxsize entries are kept the ones closest to expiring are evicted.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    namespace : str
+        Name that separates this cache from others in the same file.
+    maxsize : int
+        Number of entries kept.
+    ttl : float
+        Seconds an entry is served after it is set.
+    '''
+    def __init__(self, path, namespace, maxsize=1024, ttl=300):
+        self.namespace = namespace
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False, isolation_level=None)
+        # readers do not block the writer of another process
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('''CREATE TABLE IF NOT EXISTS cache (
+            namespace TEXT NOT NULL,
+            key BLOB NOT NULL,
+            value BLOB NOT NULL,
+            expires REAL NOT NULL,
+            PRIMARY KEY (namespace, key))''')
+
+    def get(self, key, default=None):
+        with self._lock:
+            row = self._db.execute('SELECT value FROM cache WHERE namespace = ? AND key = ? AND expires >= ?',
+                                   (self.namespace, pickle.dumps(key), time.time())).fetchone()
+        if row is None:
+            self.misses += 1
+            return default
+        self.hits += 1
+        return pickle.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        expires = time.time() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._db.execute('INSERT OR REPLACE INTO cache VALUES (?, ?, ?, ?)',
+                             (self.namespace, pickle.dumps(key), pickle.dumps(value), expires))
+            self._evict()
+
+    def add(self, key, value, ttl=None):
+        '''Sets key only if it has no live entry, atomically across processes. Returns whether it was set.'''
+        now = time.time()
+        expires = now + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                self._db.execute('DELETE FROM cache WHERE namespace = ? AND key = ? AND expires < ?',
+                                 (self.namespace, pickle.dumps(key), now))
+                cursor = self._db.execute('INSERT OR IGNORE INTO cache VALUES (?, ?, ?, ?)',
+                                          (self.namespace, pickle.dumps(key), pickle.dumps(value), expires))
+                self._db.execute('COMMIT')
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        with self._lock:
+            self._db.execute('DELETE FROM cache WHERE namespace = ? AND key = ?', (self.namespace, pickle.dumps(key)))
+
+    def invalidate(self, predicate):
+        '''Removes every entry whose key matches predicate(key).'''
+        with self._lock:
+            keys = [key for (key,) in self._db.execute('SELECT key FROM cache WHERE namespace = ?', (self.namespace,))
+                    if predicate(pickle.loads(key))]
+            self._db.executemany('DELETE FROM cache WHERE namespace = ? AND key = ?',
+                                 [(self.namespace, key) for key in keys])
+
+    def clear(self):
+        with self._lock:
+            self._db.execute('DELETE FROM cache WHERE namespace = ?', (self.namespace,))
+
+    @property
+    def hit_ratio(self):
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def __len__(self):
+        with self._lock:
+            return self._db.execute('SELECT COUNT(*) FROM cache WHERE namespace = ? AND expires >= ?',
+                                    (self.namespace, time.time())).fetchone()[0]
+
+    def _evict(self):
+        self._db.execute('DELETE FROM cache WHERE namespace = ? AND expires < ?', (self.namespace, time.time()))
+        self._db.execute('''DELETE FROM cache WHERE namespace = ? AND key IN (
+            SELECT key FROM cache WHERE namespace = ? ORDER BY expires DESC LIMIT -1 OFFSET ?)''',
+                         (self.namespace, self.namespace, self.maxsize))
+
+BACKENDS = {
+    'memory': lambda name, maxsize, ttl, **options: TTLCache(maxsize=maxsize, ttl=ttl),
+    'sqlite': lambda name, maxsize, ttl, path='cache.db', **options: SqliteCache(path, name, maxsize=maxsize, ttl=ttl)
+}
+
+def register_backend(name, factory):
+    '''Adds a cache backend. factory(name, maxsize, ttl, **options) returns a
+    cache with the methods of TTLCache, options come from the 'cache' section
+    of config.yaml.
+    '''
+    BACKENDS[name] = factory
+
+def create(name, maxsize=1024, ttl=300, settings=None):
+    '''Returns the cache called name from the backend in settings, e.g.
+    {'backend': 'sqlite', 'path': 'cache.db'}. Defaults to a TTLCache.
+    '''
+    options = dict(settings or {})
+    backend = options.pop('backend', 'memory')
+    return BACKENDS[backend](name, maxsize, ttl, **options)
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    '''Coalesces concurrent calls that share a key: the first caller runs the
+    function while the others wait for, and share, its result or exception.
+    A result can also be reused by later calls for a short window.
+
+    Callers each get their own deep copy of the result, so it is safe to modify.
+    Waiting callers give up when their deadline budget (see deadline) runs out.
+
+    Parameters
+    ----------
+    reuse : float
+        Seconds a completed result is returned to later calls, 0 to disable.
+    maxsize : int
+        Number of completed results kept for reuse.
+    results : cache
+        Cache of completed results, e.g. one shared by worker processes,
+        defaults to a TTLCache when reuse is set.
+    '''
+    def __init__(self, reuse=0, maxsize=1024, results=None):
+        if results is None and reuse:
+            results = TTLCache(maxsize=maxsize, ttl=reuse)
+        self.results = results
+        self.coalesced = 0
+        self._calls = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, fn, *args, **kwargs):
+        if self.results is not None:
+            result = self.results.get(key, _MISSING)
+            if result is not _MISSING:
+                return deepcopy(result)
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+            else:
+                self.coalesced += 1
+        if not leader:
+            left = deadline.remaining()
+            if not call.done.wait(max(left, 0) if left is not None else None):
+                raise deadline.DeadlineExceeded(f'Request budget spent waiting on a running check of {key}.')
+            if call.error is not None:
+                raise call.error
+            return deepcopy(call.result)
+        try:
+            call.result = fn(*args, **kwargs)
+            if self.results is not None:
+                self.results.set(key, call.result)
+            return deepcopy(call.result)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
@@ -1,29 +1,38 @@
 import json
 import re
+import time
+from concurrent import futures
 from datetime import date, datetime, timezone
+from functools import partial
+from itertools import groupby
 
 from loguru import logger
 from requests.exceptions import HTTPError
 
+import deadline
 import provider
+from breaker import CircuitOpen
+from clients import ClientUnavailable
 from cisco.meraki_api.exceptions import ObjectNotFound
 from meraki.exceptions import APIError
 
 MERAKI_RE = re.compile('meraki', re.I)
+# CMDB columns read by the checks, requested instead of whole records
+SITE_FIELDS = ['sys_id', 'name', 'street', 'city', 'state', 'zip', 'longitude', 'latitude']
+MERAKI_CI_FIELDS = ['name', 'serial_number', 'mac_address']
+WARRANTY_CI_FIELDS = ['sys_id', 'name', 'serial_number', 'manufacturer', 'warranty_expiration']
+# access points fetched per CMDB page while looking for the Meraki AP of a site
+MERAKI_CI_PAGE_SIZE = 50
 
-def check_outage(site,
-        prtg_api,
-        meraki_api,
-        snow_api,
-        netcloud_api):
-    # payload to post for alert extra properties
-    details = {'SiteName': site['name']}
+# seconds to wait on a probe when running concurrently
+DEFAULT_PROBE_TIMEOUT = 10
 
+def _check_provider(site):
+    details = {'Power_ProviderStatus': ''}
     # get gis outage status
     logger.info('Checking gis dataset for outages...')
     gis_response = provider.get_site_status(site)
-    logger.debug(json.dumps(gis_response, indent=2, sort_keys=True))
-    details['Power_ProviderStatus'] = ''
+    logger.opt(lazy=True).debug('{}', lambda: json.dumps(gis_response, indent=2, sort_keys=True))
     if gis_response:
         if 'PowerStatus' in gis_response:
             if gis_response['PowerStatus'] == 'Active':
@@ -42,56 +51,45 @@ def check_outage(site,
             logger.error('Cannot parse outage status.')
     else:
         logger.error('Unable to retrieve outage status.')
+    # provider status does not count as a device being up or down
+    return details, None
 
-    # get pi status
-    logger.info('Checking status of PI device...')
-    pi_response = prtg_api.get_sensors_by_name('Ping', site['name'], 'PI - LTE')
-    pi_is_up = None
-    details['PRTG_PiStatus'] = ''
-    if len(pi_response) == 1:
-        if 'status' in pi_response[0]:
-            details['PRTG_PiStatus'] = pi_response[0]['status']
-            if re.match('Up|Unusual|Warning',  details['PRTG_PiStatus']):
-                logger.info('PI device is up.')
-                pi_is_up = True
-            elif re.match('Down.*', details['PRTG_PiStatus']):
-                logger.info('PI device is down.')
-                pi_is_up = False
-            # else pi is Paused|Unknown
-        else:
-            logger.error('Could not parse pi sensor status.')
-    elif len(pi_response) > 1:
-        logger.error('More than one pi sensor was found.')
-    else:
-        logger.error('Could not find pi sensor.')
-
-    # get probe status
-    logger.info('Checking status of Probe device...')
-    probe_response = prtg_api.get_sensors_by_name('Probe Health', site['name'], 'Probe Device')
-    probe_is_up = None
-    details['PRTG_ProbeStatus'] = ''
-    if len(probe_response) == 1:
-        if 'status' in probe_response[0]:
-            details['PRTG_ProbeStatus'] = probe_response[0]['status']
-            if re.match('Up|Unusual|Warning',  details['PRTG_ProbeStatus']):
-                logger.info('Probe device is up.')
-                probe_is_up = True
-            elif re.match('Down.*', details['PRTG_ProbeStatus']):
-                logger.info('Probe device is down.')
-                probe_is_up = False
-            # else pi is Paused|Unknown
+def _check_prtg_sensor(prtg_api, site, sensor, device, key, label):
+    logger.info(f'Checking status of {label}...')
+    response = prtg_api.get_sensors_by_name(sensor, site['name'], device)
+    is_up = None
+    details = {key: ''}
+    if len(response) == 1:
+        if 'status' in response[0]:
+            details[key] = response[0]['status']
+            if re.match('Up|Unusual|Warning', details[key]):
+                logger.info(f'{label} is up.')
+                is_up = True
+            elif re.match('Down.*', details[key]):
+                logger.info(f'{label} is down.')
+                is_up = False
+            # else sensor is Paused|Unknown
         else:
-            logger.error('Could not parse probe device status.')
-    elif len(probe_response) > 1:
-        logger.error('More than one probe device was found.')
+            logger.error(f'Could not parse {label} status.')
+    elif len(response) > 1:
+        logger.error(f'More than one {label} was found.')
     else:
-        logger.error('Could not find probe device.')
+        logger.error(f'Could not find {label}.')
+    return details, is_up
 
+def _check_pi(site, prtg_api):
+    return _check_prtg_sensor(prtg_api, site, 'Ping', 'PI - LTE', 'PRTG_PiStatus', 'PI device')
+
+def _check_probe(site, prtg_api):
+    return _check_prtg_sensor(prtg_api, site, 'Probe Health', 'Probe Device', 'PRTG_ProbeStatus', 'Probe device')
+
+def _check_meraki(site, meraki_api, snow_api):
     # get meraki device and status
     logger.info('Checking status of Meraki device...')
-    cis = snow_api.get_cis_filtered_by({'sys_class_name': ['cmdb_ci_wap_network'], 'location.name': [site['name']]})
+    cis = snow_api.iter_cis_filtered_by({'sys_class_name': ['cmdb_ci_wap_network'], 'location.name': [site['name']]},
+                                        fields=MERAKI_CI_FIELDS, page_size=MERAKI_CI_PAGE_SIZE)
     meraki_is_up = None
-    details['Cisco_MerakiStatus'] = ''
+    details = {'Cisco_MerakiStatus': ''}
     try:
         ap = next(ci for ci in cis if MERAKI_RE.search(ci['name']))
     except StopIteration:
@@ -116,10 +114,12 @@ def check_outage(site,
             else:
                 logger.info('Meraki device is down.')
                 details['Cisco_MerakiStatus'] = 'Down'
+    return details, meraki_is_up
 
+def _check_cradlepoint(site, netcloud_api):
     # get cradlepoint status
     logger.info('Checking status of Cradlepoint device...')
-    details['Cradlepoint_RouterStatus'] = ''
+    details = {'Cradlepoint_RouterStatus': ''}
     cradle_is_up = None
     try:
         cradle_is_up = netcloud_api.get_router_status_by_name(site['name'])
@@ -132,14 +132,157 @@ def check_outage(site,
         else:
             logger.info('Router is down.')
             details['Cradlepoint_RouterStatus'] = 'Down'
+    return details, cradle_is_up
+
+class Source:
+    '''Evidence the outage decision is made from, e.g. the status of a device at the site.
+
+    Parameters
+    ----------
+    name : str
+        Name of the source, also its key in the probe timeouts and costs.
+    probe : callable
+        Called with the site and a dict of clients (prtg, meraki, snow,
+        netcloud), returns a (details, is_up) tuple.
+    empty : dict
+        Details reported when the source is skipped, fails or times out.
+    cost : float
+        Relative cost of the probe, cheaper sources are started first.
+    device : bool
+        Whether is_up is the status of a device at the site, so that one
+        device up settles the verdict. The provider status only matters when
+        no device is up.
+    '''
+    def __init__(self, name, probe, empty, cost=1, device=True):
+        self.name = name
+        self.probe = probe
+        self.empty = empty
+        self.cost = cost
+        self.device = device
+
+# evidence sources of check_outage, in the order their details are reported
+SOURCES = {}
+
+def register_source(source):
+    '''Adds, or replaces, an evidence source of check_outage.'''
+    SOURCES[source.name] = source
+
+# probes are looked up when called, so they can be instrumented
+register_source(Source('provider', lambda site, clients: _check_provider(site),
+                       {'Power_ProviderStatus': ''}, cost=2, device=False))
+register_source(Source('pi', lambda site, clients: _check_pi(site, clients['prtg']),
+                       {'PRTG_PiStatus': ''}, cost=1))
+register_source(Source('probe', lambda site, clients: _check_probe(site, clients['prtg']),
+                       {'PRTG_ProbeStatus': ''}, cost=1))
+register_source(Source('meraki', lambda site, clients: _check_meraki(site, clients['meraki'], clients['snow']),
+                       {'Cisco_MerakiStatus': ''}, cost=3))
+register_source(Source('cradlepoint', lambda site, clients: _check_cradlepoint(site, clients['netcloud']),
+                       {'Cradlepoint_RouterStatus': ''}, cost=2))
+
+def _settled(sources, results):
+    # one device up means the site has power, whatever the other sources say
+    return any(sources[name].device and is_up for name, (_, is_up) in results.items())
+
+def _run_sources(tiers, site, clients, executor, timeouts, short_circuit):
+    '''Run the probe of each source and return its (details, is_up) result by source name.
+
+    tiers are lists of sources of the same cost, cheapest first. Without an
+    executor probes run one after another, in that order. With one, the probes
+    of a fan-out are submitted at once and each waited on with its own timeout,
+    measured from when the fan-out started: every source in one fan-out, or
+    with short_circuit one tier at a time. Either way probes share what is left
+    of the deadline budget of the check. A probe that times out falls back to
+    its empty result. With short_circuit, sources are not started once the
+    verdict is settled, and running ones are abandoned.
+    '''
+    sources = {source.name: source for tier in tiers for source in tier}
+    results = {}
+    if executor is None:
+        for source in sources.values():
+            if short_circuit and _settled(sources, results):
+                break
+            results[source.name] = _call_probe(source.name, partial(source.probe, site, clients), source.empty)
+        return results
+    for batch in tiers if short_circuit else [list(sources.values())]:
+        if short_circuit and _settled(sources, results):
+            break
+        _fan_out(batch, sources, results, site, clients, executor, timeouts or {}, short_circuit)
+    return results
+
+def _fan_out(batch, sources, results, site, clients, executor, timeouts, short_circuit):
+    start = time.monotonic()
+    pending = {executor.submit(deadline.bind(_call_probe), source.name, partial(source.probe, site, clients), source.empty): source
+               for source in batch}
+    # seconds after start each probe is waited on
+    waits = {future: timeouts.get(source.name, timeouts.get('default', DEFAULT_PROBE_TIMEOUT))
+             for future, source in pending.items()}
+    left = deadline.remaining()
+    if left is not None:
+        waits = {future: min(wait, left) for future, wait in waits.items()}
+    try:
+        while pending and not (short_circuit and _settled(sources, results)):
+            timeout = max(0, start + min(waits[future] for future in pending) - time.monotonic())
+            done, _ = futures.wait(pending, timeout=timeout, return_when=futures.FIRST_COMPLETED)
+            for future in done:
+                results[pending.pop(future).name] = future.result()
+            for future in [f for f in pending if start + waits[f] <= time.monotonic()]:
+                source = pending.pop(future)
+                logger.error(f'Timed out after {waits[future]:.1f}s waiting on {source.name} status.')
+                results[source.name] = (dict(source.empty), None)
+    finally:
+        for future in pending:
+            future.cancel()
+
+def _call_probe(name, probe, empty):
+    try:
+        deadline.check(f'{name} status')
+        return probe()
+    except (ClientUnavailable, CircuitOpen, deadline.DeadlineExceeded) as e:
+        # an upstream that is unreachable, cut off or out of time does not fail the whole check
+        logger.error(f'Cannot check {name} status. {str(e)}')
+        return dict(empty), None
+
+def check_outage(site,
+        prtg_api,
+        meraki_api,
+        snow_api,
+        netcloud_api,
+        executor=None,
+        timeouts=None,
+        mode='full',
+        costs=None):
+    '''Collect provider and device statuses for a site and decide if it has lost power.
+
+    Passing an executor sends the probes concurrently, with per-probe timeouts
+    (in seconds) looked up by probe name in timeouts, or its 'default' key.
+
+    In 'full' mode every source is checked, for complete details. In
+    'short-circuit' mode sources are started cheapest first, by cost or its
+    override in costs, one cost tier at a time, and the rest are skipped,
+    reporting empty details, as soon as a device is up.
+    '''
+    # payload to post for alert extra properties
+    details = {'SiteName': site['name']}
+
+    costs = costs or {}
+    cost = lambda source: costs.get(source.name, source.cost)
+    tiers = [list(tier) for _, tier in groupby(sorted(SOURCES.values(), key=cost), key=cost)]
+    clients = {'prtg': prtg_api, 'meraki': meraki_api, 'snow': snow_api, 'netcloud': netcloud_api}
+    results = _run_sources(tiers, site, clients, executor, timeouts, mode == 'short-circuit')
+    skipped = [name for name in SOURCES if name not in results]
+    if skipped:
+        logger.info(f'A device is up, skipped checking {", ".join(skipped)}.')
+    for name, source in SOURCES.items():
+        details.update(results.get(name, (source.empty, None))[0])
+    device_statuses = [results.get(name, (None, None))[1] for name, source in SOURCES.items() if source.device]
 
     # Site power output
     logger.info('Determining if power outage based on collected data...')
-    if any((meraki_is_up, pi_is_up, probe_is_up, cradle_is_up)):
+    if any(device_statuses):
         logger.info('At least one sensor/device is up: not a power outage.')
         details['Power_SitePower'] = 'Up'
     elif details['Power_ProviderStatus'] == 'Up':
-        if all(status is None for status in (meraki_is_up, pi_is_up, probe_is_up, cradle_is_up)):
+        if all(status is None for status in device_statuses):
             logger.info('Could not retrieve some data but provider suggests no outage.')
             details['Power_SitePower'] = 'Likely Up'
         else:
@@ -151,16 +294,22 @@ def check_outage(site,
 
     return details
 
-def check_warranty(ci, support_api, snow_api):
+def check_warranty(ci, support_api, snow_api, coverage_cache=None):
+    '''Returns a description of the expired warranty of a configuration item, or None.
+    Coverage is read from coverage_cache, filled by warranty.WarrantySweep, before
+    asking the support API.
+    '''
     logger.info(f'Checking warranty information for configuration item {ci["name"]}.')
-    if snow_api.get_record(ci['manufacturer']['link'])['name'] != 'Cisco':
+    if snow_api.get_record(ci['manufacturer']['link'], fields=['name'])['name'] != 'Cisco':
         logger.info('Unsupported manufacturer for checking warranty.')
         return
     serial_number = ci['serial_number']
     if not serial_number:
         logger.warning(f'Configuration item {ci["name"]} is missing serial number.')
         return
-    coverage_summary = support_api.get_coverage_summary_by_sn(ci['serial_number'])[0]
+    coverage_summary = coverage_cache.get(serial_number) if coverage_cache is not None else None
+    if coverage_summary is None:
+        coverage_summary = support_api.get_coverage_summary_by_sn([serial_number])[0]
     if not coverage_summary['warranty_end_date']:
         logger.warning(f'Cannot retrieve warranty information for configuration item {ci["name"]}.')
         return
@@ -1,10 +1,14 @@
+import threading
+import time
+
 import meraki
 
 from .exceptions import ObjectNotFound
 
 class MerakiOrgApi:
-    def __init__(self, org_name=None, org_id=None, api_key=None):
-        self.db = meraki.DashboardAPI(suppress_logging=True) if not api_key else meraki.DashboardAPI(api_key, suppress_logging=True)
+    def __init__(self, org_name=None, org_id=None, api_key=None, snapshot_max_age=None, base_url=meraki.DEFAULT_BASE_URL, timeout=60):
+        # timeout: seconds to wait on each Meraki API request
+        self.db = meraki.DashboardAPI(base_url=base_url, single_request_timeout=timeout, suppress_logging=True) if not api_key else meraki.DashboardAPI(api_key, base_url=base_url, single_request_timeout=timeout, suppress_logging=True)
         if org_id:
             org = self.db.organizations.getOrganization(org_id)
             try:
@@ -26,8 +30,66 @@ class MerakiOrgApi:
         self.id = org['id']
         self.name = org['name']
         self.url = org['url']
+        # org-wide device snapshot, see refresh_snapshot()
+        self.snapshot_max_age = snapshot_max_age
+        self._snapshot_time = None
+        self._devices_by_serial = {}
+        self._devices_by_mac = {}
+        self._devices_by_name = {}
+        self._statuses_by_serial = {}
+        self._snapshot_lock = threading.Lock()
+
+    def refresh_snapshot(self):
+        '''Fetches every device and device status in the organization and
+        indexes them by serial, mac and name so lookups skip the Meraki API
+        while the snapshot is younger than snapshot_max_age seconds.
+        '''
+        devices = self.db.organizations.getOrganizationDevices(self.id, total_pages='all')
+        statuses = self.db.organizations.getOrganizationDevicesStatuses(self.id, total_pages='all')
+        by_serial = {d['serial']: d for d in devices if d.get('serial')}
+        by_mac = {d['mac'].lower(): d for d in devices if d.get('mac')}
+        by_name = {d['name']: d for d in devices if d.get('name')}
+        statuses_by_serial = {s['serial']: s for s in statuses if s.get('serial')}
+        with self._snapshot_lock:
+            self._devices_by_serial = by_serial
+            self._devices_by_mac = by_mac
+            self._devices_by_name = by_name
+            self._statuses_by_serial = statuses_by_serial
+            self._snapshot_time = time.monotonic()
+
+    def export_state(self):
+        '''Returns the snapshot and when it was refreshed, for load_state() in another process.'''
+        with self._snapshot_lock:
+            return {'devices_by_serial': self._devices_by_serial,
+                    'devices_by_mac': self._devices_by_mac,
+                    'devices_by_name': self._devices_by_name,
+                    'statuses_by_serial': self._statuses_by_serial,
+                    'updated': time.time() - (time.monotonic() - self._snapshot_time) if self._snapshot_time is not None else None}
+
+    def load_state(self, state):
+        '''Replaces the snapshot with one from export_state().'''
+        with self._snapshot_lock:
+            self._devices_by_serial = state['devices_by_serial']
+            self._devices_by_mac = state['devices_by_mac']
+            self._devices_by_name = state['devices_by_name']
+            self._statuses_by_serial = state['statuses_by_serial']
+            self._snapshot_time = time.monotonic() - (time.time() - state['updated']) if state['updated'] is not None else None
+
+    def snapshot_is_fresh(self):
+        if self.snapshot_max_age is None or self._snapshot_time is None:
+            return False
+        return time.monotonic() - self._snapshot_time <= self.snapshot_max_age
+
+    def _from_snapshot(self, index, key):
+        if not self.snapshot_is_fresh():
+            return None
+        with self._snapshot_lock:
+            return getattr(self, index).get(key)
 
     def get_device_by_name(self, name):
+        device = self._from_snapshot('_devices_by_name', name)
+        if device:
+            return device
         response = self.db.organizations.getOrganizationDevices(self.id, name=name)
         try:
             return response[0]
@@ -35,6 +97,9 @@ class MerakiOrgApi:
             raise ObjectNotFound(f"Cannot get device status with name: {name}")
 
     def get_device_by_mac(self, mac):
+        device = self._from_snapshot('_devices_by_mac', mac.lower()) if mac else None
+        if device:
+            return device
         response = self.db.organizations.getOrganizationDevices(self.id, mac=mac)
         try:
             return response[0]
@@ -42,10 +107,17 @@ class MerakiOrgApi:
             raise ObjectNotFound(f"Cannot get device status with mac: {mac}")
 
     def get_device_status(self, serial):
+        status = self._from_snapshot('_statuses_by_serial', serial)
+        if status:
+            return self._is_online(status)
         response = self.db.organizations.getOrganizationDevicesStatuses(self.id, serials=[serial])
         try:
-            if response[0]['status'] == 'offline' or response[0]['status'] == 'dormant':
-                return False
-            return True
+            return self._is_online(response[0])
         except IndexError:
             raise ObjectNotFound(f"Cannot get device status with serial: {serial}")
+
+    @staticmethod
+    def _is_online(status):
+        if status['status'] == 'offline' or status['status'] == 'dormant':
+            return False
+        return True
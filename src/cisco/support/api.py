@@ -28,7 +28,7 @@ class SupportApi:
         return summeries
 
 # for demo purposes
-import requests
+import transport
 from config import config
 URL = config['cisco']['url']
 class SimulatedSupportApi:
@@ -39,13 +39,13 @@ class SimulatedSupportApi:
     def get_coverage_summary_by_sn(self, serial_numbers):
         url = URL + '/sn2info/v2/coverage/summary/serial_numbers/'
         sn_path_params = ','.join(serial_numbers)
-        response = requests.get(url + sn_path_params)
+        response = transport.get_session('cisco').get(url + sn_path_params)
         response.raise_for_status()
         payload = response.json()
         summeries = payload['serial_numbers']
         for i in range(2, payload['pagination_response_record']['last_index']):
             params = {'page_index': i}
-            response = requests.get(url + sn_path_params, params=params)
+            response = transport.get_session('cisco').get(url + sn_path_params, params=params)
             response.raise_for_status()
             payload = response.json()
             summeries.extend(payload['serial_numbers'])
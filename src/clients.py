@@ -0,0 +1,121 @@
+'''Upstream clients created in the background instead of at import time.
+
+Some clients call their upstream when they are constructed, e.g. MerakiOrgApi
+looks up its organization and PrtgApi validates its credentials. Wrapping
+them in a LazyClient lets the app start without waiting on, or failing
+because of, one slow or unreachable upstream: clients are created in
+parallel by start_all() on startup, or on first use, and /ready reports
+the state of each.
+'''
+import threading
+import time
+
+from loguru import logger
+
+class ClientUnavailable(Exception):
+    pass
+
+class LazyClient:
+    '''Proxy to an upstream client that is created by factory() on first use.
+
+    Attribute access is forwarded to the client, so the proxy can stand in
+    for it. If factory() fails, uses within retry_interval seconds raise
+    ClientUnavailable right away, later ones try to create the client again.
+
+    Parameters
+    ----------
+    name : str
+        Name of the client in logs and /ready.
+    factory : callable
+        Creates the client, called with no arguments.
+    on_ready : callable
+        Called with the client once created, e.g. to instrument it.
+    retry_interval : float
+        Seconds to wait before creating a failed client again.
+    '''
+    def __init__(self, name, factory, on_ready=None, retry_interval=30):
+        self._name = name
+        self._factory = factory
+        self._on_ready = on_ready
+        self._retry_interval = retry_interval
+        self._client = None
+        self._state = 'pending'
+        self._error = None
+        self._since = time.time()
+        self._lock = threading.Lock()
+
+    def get(self):
+        '''Returns the client, creating it first if needed.
+
+        Raises:
+            ClientUnavailable: when the client cannot be created
+        '''
+        client = self._client
+        if client is not None:
+            return client
+        with self._lock:
+            if self._client is not None:
+                return self._client
+            if self._state == 'failed' and time.time() - self._since < self._retry_interval:
+                raise ClientUnavailable(f'{self._name} client is unavailable: {self._error}')
+            self._set_state('starting')
+            start = time.perf_counter()
+            try:
+                client = self._factory()
+                if self._on_ready is not None:
+                    self._on_ready(client)
+            except Exception as e:
+                self._set_state('failed', str(e) or type(e).__name__)
+                logger.error(f'Failed to create {self._name} client. Cause: {self._error}')
+                raise ClientUnavailable(f'{self._name} client is unavailable: {self._error}') from e
+            self._client = client
+            self._set_state('ready')
+            logger.info(f'Created {self._name} client in {time.perf_counter() - start:.2f}s.')
+            return client
+
+    def start(self):
+        '''Creates the client if needed, logging instead of raising on failure.'''
+        try:
+            self.get()
+        except ClientUnavailable:
+            pass
+
+    def status(self):
+        return {'state': self._state, 'error': self._error, 'since': self._since}
+
+    def _set_state(self, state, error=None):
+        self._state = state
+        self._error = error
+        self._since = time.time()
+
+    def __getattr__(self, attr):
+        # only reached for attributes the proxy itself does not have
+        return getattr(self.get(), attr)
+
+class Registry:
+    '''Clients of the app, by name, for starting them together and reporting their state.'''
+    def __init__(self):
+        self.clients = {}
+
+    def lazy(self, name, factory, on_ready=None, retry_interval=30):
+        '''Adds and returns a LazyClient.'''
+        client = LazyClient(name, factory, on_ready=on_ready, retry_interval=retry_interval)
+        self.clients[name] = client
+        return client
+
+    def add(self, name, client):
+        '''Adds a client that was created already, e.g. one that is cheap to create.'''
+        lazy = LazyClient(name, lambda: client)
+        lazy._client = client
+        lazy._set_state('ready')
+        self.clients[name] = lazy
+        return client
+
+    def start_all(self):
+        '''Creates every pending client at the same time, each on its own daemon thread.'''
+        for name, client in self.clients.items():
+            if client.status()['state'] == 'pending':
+                threading.Thread(target=client.start, name=f'start-{name}', daemon=True).start()
+
+    def status(self):
+        return {name: client.status() for name, client in self.clients.items()}
@@ -1,6 +1,8 @@
+import os
 from pathlib import PurePath
 
 import yaml
 
-with open(PurePath(__file__).with_name('config.yaml')) as fp:
+# ADARCA_CONFIG points to another config file, e.g. one written by the benchmark harness
+with open(os.environ.get('ADARCA_CONFIG', PurePath(__file__).with_name('config.yaml'))) as fp:
     config = yaml.safe_load(fp)
@@ -0,0 +1,51 @@
+'''Per-request deadline budgets.
+
+A check sets its budget with limit(). HTTP requests sent through
+transport.Session and outage check probes read what is left with remaining()
+and give up instead of outliving the check. The deadline is kept in a context
+variable, so it follows the check into threads that run bind()-ed functions,
+e.g. probes on the probe executor.
+'''
+import contextlib
+import contextvars
+import time
+from functools import partial
+
+class DeadlineExceeded(Exception):
+    pass
+
+_deadline = contextvars.ContextVar('deadline', default=None)
+
+@contextlib.contextmanager
+def limit(seconds):
+    '''Gives the block a budget of seconds, unless an enclosing budget ends sooner. 0 or None sets no budget.'''
+    if not seconds:
+        yield
+        return
+    deadline = time.monotonic() + seconds
+    current = _deadline.get()
+    token = _deadline.set(deadline if current is None else min(deadline, current))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+def remaining():
+    '''Returns the seconds left in the budget, or None without one.'''
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+def check(what):
+    '''Returns the seconds left in the budget, or None without one.
+
+    Raises:
+        DeadlineExceeded: when the budget is spent
+    '''
+    left = remaining()
+    if left is not None and left <= 0:
+        raise DeadlineExceeded(f'Request budget spent before {what}.')
+    return left
+
+def bind(fn):
+    '''Returns fn bound to a copy of the current context, to run it on another thread within the budget.'''
+    return partial(contextvars.copy_context().run, fn)
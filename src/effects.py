@@ -0,0 +1,89 @@
+import time
+from concurrent import futures
+
+from loguru import logger
+
+import deadline
+
+class ActionsFailed(Exception):
+    '''Raised by Dispatcher.run() when an action raised or was skipped.'''
+    def __init__(self, outcomes):
+        self.outcomes = outcomes
+        failed = [f'{name} ({outcome["error"]})' for name, outcome in outcomes.items()
+                  if outcome['status'] in ('failed', 'skipped')]
+        super().__init__(f'Actions did not complete: {", ".join(failed)}.')
+
+class Dispatcher:
+    '''Runs the side effects of an alert, e.g. tagging it or creating an incident.
+
+    Each action starts as soon as the actions it comes after have succeeded, so
+    independent actions run at the same time and a slow or failing one only
+    holds back the actions that depend on it. An action whose dependency failed
+    is skipped. Actions run within the deadline budget of the caller (see deadline).
+
+    Parameters
+    ----------
+    executor : concurrent.futures.Executor
+        Runs the actions. Without one, actions run one after another in the
+        order they were added.
+    progress : callable
+        Called with the name of each action as it starts, e.g. jobs.Job.progress.
+    '''
+    def __init__(self, executor=None, progress=None):
+        self.executor = executor
+        self.progress = progress
+        self._actions = {}
+
+    def add(self, name, fn, *args, after=(), **kwargs):
+        '''Adds fn(*args, **kwargs) as action name, to run once every action in after succeeded.'''
+        unknown = [dep for dep in after if dep not in self._actions]
+        if unknown:
+            raise ValueError(f'Action {name} comes after unknown action(s): {", ".join(unknown)}.')
+        self._actions[name] = (fn, args, kwargs, tuple(after))
+
+    def run(self):
+        '''Runs every action and returns their outcomes, keyed by name, in the
+        order added. An outcome has a status (succeeded | failed | skipped), the
+        result or error and the seconds the action took.
+
+        Raises:
+            ActionsFailed: when an action failed or was skipped, after all others ran
+        '''
+        outcomes = {}
+        pending = dict(self._actions)
+        running = {}
+        while pending or running:
+            for name, (fn, args, kwargs, after) in list(pending.items()):
+                blocked = [dep for dep in after if outcomes.get(dep, {}).get('status') in ('failed', 'skipped')]
+                if blocked:
+                    logger.warning(f'Skipping {name}: {", ".join(blocked)} did not complete.')
+                    outcomes[name] = {'status': 'skipped', 'result': None,
+                                      'error': f'{", ".join(blocked)} did not complete', 'seconds': 0.0}
+                    del pending[name]
+                elif all(outcomes.get(dep, {}).get('status') == 'succeeded' for dep in after):
+                    del pending[name]
+                    if self.progress:
+                        self.progress(name)
+                    if self.executor is None:
+                        outcomes[name] = self._call(name, fn, args, kwargs)
+                    else:
+                        running[self.executor.submit(deadline.bind(self._call), name, fn, args, kwargs)] = name
+            if running:
+                done, _ = futures.wait(running, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    outcomes[running.pop(future)] = future.result()
+        outcomes = {name: outcomes[name] for name in self._actions}
+        if any(outcome['status'] != 'succeeded' for outcome in outcomes.values()):
+            raise ActionsFailed(outcomes)
+        return outcomes
+
+    @staticmethod
+    def _call(name, fn, args, kwargs):
+        start = time.perf_counter()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            logger.exception(f'Action {name} failed.')
+            return {'status': 'failed', 'result': None, 'error': str(e) or type(e).__name__,
+                    'seconds': time.perf_counter() - start}
+        return {'status': 'succeeded', 'result': result, 'error': None, 'seconds': time.perf_counter() - start}
@@ -1,9 +1,13 @@
 import json
+import re
+import sqlite3
+import threading
+import time
 from copy import deepcopy
 
-import requests
 from loguru import logger
 
+import transport
 from config import config
 
 class NoCandidateFound(Exception):
@@ -12,7 +16,102 @@ class NoCandidateFound(Exception):
 class LowScore(Exception):
     pass
 
+class GeocodeCache:
+    """On-disk cache of geocoded addresses. Successful lookups and addresses
+    that could not be geocoded (LowScore, NoCandidateFound) are both stored,
+    each with their own time to live.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    hit_ttl : int
+        Seconds to keep a found longitude and latitude.
+    miss_ttl : int
+        Seconds to keep an address that could not be geocoded.
+    """
+
+    MISSES = {cls.__name__: cls for cls in (NoCandidateFound, LowScore)}
+
+    def __init__(self, path, hit_ttl=30*24*60*60, miss_ttl=24*60*60):
+        self.hit_ttl = hit_ttl
+        self.miss_ttl = miss_ttl
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute("""CREATE TABLE IF NOT EXISTS geocode (
+                address TEXT PRIMARY KEY,
+                longitude REAL,
+                latitude REAL,
+                error TEXT,
+                message TEXT,
+                expires REAL NOT NULL)""")
+
+    @staticmethod
+    def normalize(address):
+        address = re.sub(r'\s*,\s*', ', ', address.strip().lower())
+        return re.sub(r'\s+', ' ', address)
+
+    def get(self, address):
+        """Returns the cached (longitude, latitude) of an address, or None if it is not cached.
+
+        Raises:
+            NoCandidateFound, LowScore: when the address is cached as a miss
+        """
+        with self._lock:
+            row = self._db.execute('SELECT longitude, latitude, error, message, expires FROM geocode WHERE address = ?',
+                                   (self.normalize(address),)).fetchone()
+        if row is None or row[4] < time.time():
+            self.misses += 1
+            return None
+        self.hits += 1
+        long, lat, error, message, _ = row
+        if error:
+            raise self.MISSES[error](message)
+        return long, lat
+
+    def set(self, address, long, lat):
+        self._put(address, long, lat, None, None, self.hit_ttl)
+
+    def set_miss(self, address, error):
+        self._put(address, None, None, type(error).__name__, str(error), self.miss_ttl)
+
+    def _put(self, address, long, lat, error, message, ttl):
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO geocode VALUES (?, ?, ?, ?, ?, ?)',
+                             (self.normalize(address), long, lat, error, message, time.time() + ttl))
+
+CACHE_CONFIG = config["geocode"].get("cache")
+CACHE = GeocodeCache(CACHE_CONFIG["path"],
+                     hit_ttl=CACHE_CONFIG.get("hit_ttl", 30*24*60*60),
+                     miss_ttl=CACHE_CONFIG.get("miss_ttl", 24*60*60)) if CACHE_CONFIG else None
+
+def format_address(site):
+    """Formats the address of a SNOW location record for geocoding."""
+    address = ', '.join((site['street'], site['city'], site['state']))
+    return ' '.join((address, site['zip']))
+
 def get_long_lat(address):
+    """Looks up an address in the geocode cache, if configured, before geocoding it with
+    find_long_lat(). Addresses that cannot be geocoded are cached as well.
+    """
+    if CACHE is None:
+        return find_long_lat(address)
+    cached = CACHE.get(address)
+    if cached is not None:
+        logger.debug(f"Address found in geocode cache: {address}")
+        return cached
+    try:
+        long, lat = find_long_lat(address)
+    except (NoCandidateFound, LowScore) as e:
+        CACHE.set_miss(address, e)
+        raise
+    CACHE.set(address, long, lat)
+    return long, lat
+
+def find_long_lat(address):
     """Uses ArcGIS's REST API 'findAddressCandidates' to find the longitude and latitude of a given address.
     If API returns multiple results, return the most accurate and acceptable, i.e. above minScore, address.
     (more at: https://developers.arcgis.com/rest/geocode/api-reference/geocoding-find-address-candidates.htm)
@@ -31,13 +130,13 @@ def get_long_lat(address):
         if address could not be found or score is below acceptable.
     """
 
-    url = "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/findAddressCandidates"
+    url = config["geocode"].get("url", "https://geocode.arcgis.com/arcgis/rest/services/World/GeocodeServer/findAddressCandidates")
     headers = deepcopy(config["geocode"]["headers"])
     params = deepcopy(config["geocode"]["params"])
 
     params["SingleLine"] = address
 
-    response = requests.get(url, headers=headers, params=params)
+    response = transport.get_session('geocode').get(url, headers=headers, params=params)
 
     jsonResponse = json.loads(response.content)
 
@@ -0,0 +1,181 @@
+import queue
+import threading
+import time
+import uuid
+
+from loguru import logger
+
+class QueueFull(Exception):
+    pass
+
+class Job:
+    '''A unit of work run by a JobQueue worker. The function running the job
+    reports what it is doing through progress() so it can be polled.
+    '''
+    def __init__(self, name=None, store=None):
+        self.id = uuid.uuid4().hex
+        # cache shared by worker processes the job's status is published to, see save()
+        self.store = store
+        self.name = name
+        self.status = 'queued'
+        self.step = None
+        self.steps = []
+        # outcomes of the job's side effects, see effects.Dispatcher
+        self.actions = {}
+        self.result = None
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+
+    def progress(self, step):
+        logger.debug(f'Job {self.id} step: {step}')
+        self.step = step
+        self.steps.append({'step': step, 'time': time.time()})
+        self.save()
+
+    def save(self):
+        '''Publishes the job's status to store, so any worker process can answer a status lookup.'''
+        if self.store is not None:
+            self.store.set(self.id, self.to_dict())
+
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'name': self.name,
+            'status': self.status,
+            'step': self.step,
+            'steps': list(self.steps),
+            'actions': dict(self.actions),
+            'result': self.result,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+class JobQueue:
+    '''Bounded queue of jobs run by a fixed pool of worker threads.
+
+    Parameters
+    ----------
+    workers : int
+        Number of jobs run at the same time.
+    max_size : int
+        Number of jobs waiting to run before submit() raises QueueFull.
+    retention : int
+        Seconds a finished job is kept around for status lookups.
+    store : cache
+        Cache shared by worker processes that job statuses are published to,
+        so status() finds jobs queued by another process.
+    '''
+    def __init__(self, workers=4, max_size=100, retention=3600, store=None):
+        self.workers = workers
+        self.retention = retention
+        self.store = store
+        self._queue = queue.Queue(maxsize=max_size)
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._threads = []
+        self._busy = 0
+
+    def start(self):
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._work, name=f'job-worker-{i}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout=None):
+        '''Lets the workers finish the queued jobs and stop, waiting at most
+        timeout seconds in total. Jobs still queued after that are dropped.
+        '''
+        end = None if timeout is None else time.monotonic() + timeout
+        stops = len(self._threads)
+        # a full queue takes a stop marker once a worker picks up a job
+        while stops:
+            try:
+                self._queue.put_nowait(None)
+                stops -= 1
+            except queue.Full:
+                if end is not None and time.monotonic() >= end:
+                    break
+                time.sleep(0.05)
+        for thread in self._threads:
+            thread.join(None if end is None else max(end - time.monotonic(), 0))
+        if self.size:
+            logger.warning(f'Dropping {self.size} queued job(s) on shutdown.')
+        self._threads = []
+
+    def submit(self, fn, *args, name=None):
+        '''Queue fn(job, *args) to run on a worker and return its Job.
+
+        Raises:
+            QueueFull: when max_size jobs are already waiting
+        '''
+        self._prune()
+        job = Job(name, store=self.store)
+        with self._lock:
+            self._jobs[job.id] = job
+        try:
+            self._queue.put_nowait((job, fn, args))
+        except queue.Full:
+            with self._lock:
+                del self._jobs[job.id]
+            raise QueueFull(f'Job queue is full ({self._queue.maxsize} jobs waiting).')
+        job.save()
+        return job
+
+    def get(self, id):
+        with self._lock:
+            return self._jobs.get(id)
+
+    def status(self, id):
+        '''Returns the status of a job as a dict, or None. Jobs of other worker
+        processes are looked up in store.
+        '''
+        job = self.get(id)
+        if job is not None:
+            return job.to_dict()
+        return self.store.get(id) if self.store is not None else None
+
+    @property
+    def size(self):
+        '''Number of jobs waiting to run.'''
+        return self._queue.qsize()
+
+    @property
+    def busy(self):
+        '''Number of workers currently running a job.'''
+        return self._busy
+
+    def _work(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            job, fn, args = item
+            with self._lock:
+                self._busy += 1
+            job.status = 'running'
+            job.started = time.time()
+            job.save()
+            try:
+                job.result = fn(job, *args)
+            except Exception as e:
+                logger.exception(f'Job {job.id} failed.')
+                job.error = str(e) or type(e).__name__
+                job.status = 'failed'
+            else:
+                job.status = 'succeeded'
+            finally:
+                job.finished = time.time()
+                job.save()
+                with self._lock:
+                    self._busy -= 1
+
+    def _prune(self):
+        cutoff = time.time() - self.retention
+        with self._lock:
+            expired = [id for id, job in self._jobs.items() if job.finished and job.finished < cutoff]
+            for id in expired:
+                del self._jobs[id]
@@ -0,0 +1,130 @@
+import json
+import sqlite3
+import threading
+import time
+
+class Journal:
+    '''On-disk record of the webhook alerts ADARCA processed and of the steps
+    completed for each, keyed by Opsgenie alert id.
+
+    Retries of an alert that already finished are answered from the journal,
+    and alerts interrupted by a restart are resumed: steps with a recorded
+    result return it instead of calling the upstream again.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    retention : int
+        Seconds a finished alert is kept before prune() removes it.
+    '''
+    def __init__(self, path, retention=7*24*60*60):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        with self._db:
+            self._db.execute('''CREATE TABLE IF NOT EXISTS alerts (
+                alert_id TEXT PRIMARY KEY,
+                job_id TEXT,
+                status TEXT NOT NULL,
+                request TEXT NOT NULL,
+                result TEXT,
+                error TEXT,
+                created REAL NOT NULL,
+                updated REAL NOT NULL)''')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS steps (
+                alert_id TEXT NOT NULL,
+                step TEXT NOT NULL,
+                result TEXT,
+                completed REAL NOT NULL,
+                PRIMARY KEY (alert_id, step))''')
+
+    def get(self, alert_id):
+        '''Returns the journal entry of an alert as a dict, or None.'''
+        with self._lock:
+            row = self._db.execute('SELECT alert_id, job_id, status, request, result, error, created, updated '
+                                   'FROM alerts WHERE alert_id = ?', (alert_id,)).fetchone()
+        return self._entry(row) if row else None
+
+    def begin(self, alert_id, request, job_id=None):
+        '''Records that the alert is being processed, keeping steps completed by earlier attempts.'''
+        now = time.time()
+        with self._lock, self._db:
+            self._db.execute('''INSERT INTO alerts VALUES (?, ?, 'running', ?, NULL, NULL, ?, ?)
+                ON CONFLICT (alert_id) DO UPDATE SET job_id = excluded.job_id, status = 'running',
+                    error = NULL, updated = excluded.updated''',
+                (alert_id, job_id, json.dumps(request), now, now))
+
+    def claim(self, alert_id, request, replaces=None):
+        '''Records that the alert is being processed, like begin(), unless
+        another thread or worker process claimed it first. Returns whether the
+        caller claimed it. An alert that failed can be claimed again, as can
+        one still running under job replaces, e.g. a job that was lost.
+        '''
+        now = time.time()
+        with self._lock, self._db:
+            inserted = self._db.execute('''INSERT INTO alerts VALUES (?, NULL, 'running', ?, NULL, NULL, ?, ?)
+                ON CONFLICT (alert_id) DO NOTHING''', (alert_id, json.dumps(request), now, now)).rowcount
+            if inserted:
+                return True
+            # only one claimer still sees the old status and job id
+            return self._db.execute('''UPDATE alerts SET job_id = NULL, status = 'running', error = NULL, updated = ?
+                WHERE alert_id = ? AND (status = 'failed' OR (status = 'running' AND job_id = ?))''',
+                (now, alert_id, replaces)).rowcount == 1
+
+    def assign(self, alert_id, job_id):
+        '''Records the id of the job processing the alert.'''
+        with self._lock, self._db:
+            self._db.execute('UPDATE alerts SET job_id = ? WHERE alert_id = ?', (job_id, alert_id))
+
+    def finish(self, alert_id, result=None, error=None):
+        '''Marks the alert succeeded, or failed when error is given.'''
+        with self._lock, self._db:
+            self._db.execute('UPDATE alerts SET status = ?, result = ?, error = ?, updated = ? WHERE alert_id = ?',
+                             ('failed' if error else 'succeeded', json.dumps(result), error, time.time(), alert_id))
+
+    def step(self, alert_id, name, fn, *args, **kwargs):
+        '''Returns the recorded result of step name of the alert, or runs
+        fn(*args, **kwargs) and records its result. Results must be JSON
+        serializable. Nothing is recorded when fn raises, so the step runs
+        again on the next attempt.
+        '''
+        with self._lock:
+            row = self._db.execute('SELECT result FROM steps WHERE alert_id = ? AND step = ?',
+                                   (alert_id, name)).fetchone()
+        if row is not None:
+            return json.loads(row[0])
+        result = fn(*args, **kwargs)
+        with self._lock, self._db:
+            self._db.execute('INSERT OR REPLACE INTO steps VALUES (?, ?, ?, ?)',
+                             (alert_id, name, json.dumps(result), time.time()))
+        return result
+
+    def unfinished(self):
+        '''Returns the entries of alerts that were still running, e.g. when the process stopped.'''
+        with self._lock:
+            rows = self._db.execute("SELECT alert_id, job_id, status, request, result, error, created, updated "
+                                    "FROM alerts WHERE status = 'running' ORDER BY created").fetchall()
+        return [self._entry(row) for row in rows]
+
+    def prune(self):
+        '''Removes alerts, and their steps, that finished more than retention seconds ago.'''
+        cutoff = time.time() - self.retention
+        with self._lock, self._db:
+            self._db.execute("DELETE FROM steps WHERE alert_id IN "
+                             "(SELECT alert_id FROM alerts WHERE status != 'running' AND updated < ?)", (cutoff,))
+            self._db.execute("DELETE FROM alerts WHERE status != 'running' AND updated < ?", (cutoff,))
+
+    @staticmethod
+    def _entry(row):
+        alert_id, job_id, status, request, result, error, created, updated = row
+        return {
+            'alert_id': alert_id,
+            'job_id': job_id,
+            'status': status,
+            'request': json.loads(request),
+            'result': json.loads(result) if result else None,
+            'error': error,
+            'created': created,
+            'updated': updated
+        }
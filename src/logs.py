@@ -0,0 +1,123 @@
+'''Logging setup shared by the main process and uvicorn worker processes.
+
+Request threads never wait on a sink: the file sink is written by loguru's
+queue-backed writer thread (enqueue), and syslog records are handed to a
+BatchedSink whose thread sends them in batches. Debug payloads are rendered
+with logger.opt(lazy=True), so nothing is serialized unless a sink will emit it.
+'''
+import logging
+import logging.handlers
+import queue
+import sys
+import threading
+import time
+
+from loguru import logger
+
+class BatchedSink:
+    '''Loguru sink that queues messages and hands them, in batches, to write()
+    on a daemon thread, so the logging thread does not wait on I/O.
+
+    Parameters
+    ----------
+    write : callable
+        Called with a list of messages.
+    max_batch : int
+        Most messages passed to write() at once.
+    flush_interval : float
+        Seconds a message waits for others to join its batch.
+    error_interval : float
+        Seconds between reports of batches write() failed on, e.g. while the
+        syslog server is down.
+    '''
+    def __init__(self, write, max_batch=500, flush_interval=0.5, error_interval=60):
+        self._write = write
+        self.max_batch = max_batch
+        self.flush_interval = flush_interval
+        self.error_interval = error_interval
+        self._failed = 0
+        self._error = None
+        self._reported = None
+        self._queue = queue.SimpleQueue()
+        self._thread = threading.Thread(target=self._run, name='log-batcher', daemon=True)
+        self._thread.start()
+
+    def write(self, message):
+        self._queue.put(message)
+
+    def stop(self):
+        '''Writes the queued messages, called by loguru when the sink is removed.'''
+        self._queue.put(None)
+        self._thread.join()
+        if self._failed:
+            self._report()
+
+    def _run(self):
+        while True:
+            message = self._queue.get()
+            if message is None:
+                return
+            batch = [message]
+            try:
+                while len(batch) < self.max_batch:
+                    message = self._queue.get(timeout=self.flush_interval)
+                    if message is None:
+                        self._flush(batch)
+                        return
+                    batch.append(message)
+            except queue.Empty:
+                pass
+            self._flush(batch)
+
+    def _flush(self, batch):
+        try:
+            self._write(batch)
+        except Exception as e:
+            self._failed += len(batch)
+            self._error = str(e)
+            now = time.monotonic()
+            if self._reported is None or now - self._reported >= self.error_interval:
+                self._report()
+                self._reported = now
+
+    def _report(self):
+        # not through the logger, which would hand the report back to this failing sink
+        sys.stderr.write(f'Failed to write {self._failed} log message(s). Cause: {self._error}\n')
+        self._failed = 0
+
+def _syslog_writer(handler):
+    def write(messages):
+        for message in messages:
+            record = message.record
+            handler.handle(logging.getLogger().makeRecord(
+                record['name'], record['level'].no, record['file'].path, record['line'],
+                str(message).rstrip('\n'), (), None, record['function']))
+    return write
+
+def configure(logger_config):
+    '''Adds the console, file and syslog sinks of the logger section of config.yaml.'''
+    if 'console' in logger_config:
+        console_level = logger_config['console'].get('log_level', 'INFO').upper()
+
+        # remove default handler
+        logger.remove()
+        logger.add(sys.stderr, level=console_level)
+
+    if 'file' in logger_config:
+        file_name = logger_config['file']['name']
+        file_level = logger_config['file'].get('log_level', 'INFO').upper()
+
+        # written by loguru's writer thread, which keeps its name substitution and rotation
+        logger.add(file_name, level=file_level, enqueue=True)
+
+    if 'syslog' in logger_config:
+        syslog_host = logger_config['syslog']['host']
+        syslog_port = logger_config['syslog'].get('port', 514)
+        syslog_level = logger_config['syslog'].get('log_level', 'INFO').upper()
+
+        handler = logging.handlers.SysLogHandler(
+            address=(syslog_host, syslog_port))
+        logger.add(BatchedSink(_syslog_writer(handler),
+                               max_batch=logger_config['syslog'].get('max_batch', 500),
+                               flush_interval=logger_config['syslog'].get('flush_interval', 0.5)),
+                   level=syslog_level, format='{message}')
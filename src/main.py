@@ -1,40 +1,35 @@
-import logging.handlers
-import sys
+import glob
+import os
+import tempfile
 
 import uvicorn
 from loguru import logger
 
+import logs
 from config import config
-import api
 
-if __name__ == '__main__':
-    # configure logging
-    if 'console' in config['logger']:
-        CONSOLE_LEVEL = config['logger']['console'].get('log_level', 'INFO').upper()
-
-        # remove default handler
-        logger.remove()
-        logger.add(sys.stderr, level=CONSOLE_LEVEL)
-
-    if 'file' in config['logger']:
-        FILE_NAME = config['logger']['file']['name']
-        FILE_LEVEL = config['logger']['file'].get('log_level', 'INFO').upper()
-
-        logger.add(FILE_NAME, level=FILE_LEVEL)
-
-    if 'syslog' in config['logger']:
-        SYSLOG_HOST = config['logger']['syslog']['host']
-        SYSLOG_PORT = config['logger']['syslog'].get('port', 514)
-        SYSLOG_LEVEL = config['logger']['syslog'].get('log_level', 'INFO').upper()
-
-        handler = logging.handlers.SysLogHandler(
-            address=(SYSLOG_HOST, SYSLOG_PORT))
-        logger.add(handler, level=SYSLOG_LEVEL)
+# configure logging, also in worker processes, which import this module again as __mp_main__
+logs.configure(config['logger'])
 
+if __name__ == '__main__':
     HOST = config['web'].get('host', '0.0.0.0')
     PORT = config['web'].get('port', 8080)
     LOG_LEVEL = config['web'].get('log_level', 'INFO')
     PROXY = config['web'].get('proxy', '/')
+    WORKERS = config['web'].get('workers', 1)
 
     # start api
-    uvicorn.run(api.app, host=HOST, port=PORT, root_path=PROXY, log_level=LOG_LEVEL)
+    if WORKERS > 1:
+        # workers write their metrics to files in this directory, merged at /metrics, see metrics
+        metrics_dir = os.environ.setdefault('PROMETHEUS_MULTIPROC_DIR', config.get('metrics', {}).get('multiproc_dir')
+                                            or tempfile.mkdtemp(prefix='adarca-metrics-'))
+        os.makedirs(metrics_dir, exist_ok=True)
+        for stale in glob.glob(os.path.join(metrics_dir, '*.db')):
+            os.remove(stale)
+        # each worker process imports the app itself
+        uvicorn.run('api:app', host=HOST, port=PORT, root_path=PROXY, log_level=LOG_LEVEL, workers=WORKERS)
+    else:
+        import api
+        uvicorn.run(api.app, host=HOST, port=PORT, root_path=PROXY, log_level=LOG_LEVEL)
+    # write what is still queued for the file and syslog sinks
+    logger.remove()
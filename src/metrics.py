@@ -0,0 +1,162 @@
+'''Prometheus metrics of the API, its upstream calls, queues and caches.
+
+Upstream clients and checks are instrumented by wrapping their existing methods
+and functions with instrument() and instrument_module(), so no call site has
+to change. Shared HTTP sessions (see transport) time their own requests.
+
+With several worker processes, main.py sets PROMETHEUS_MULTIPROC_DIR and every
+worker writes its metrics there, so /metrics reports all of them whichever
+worker serves the scrape, see generate(). Gauges read at scrape time cannot be
+read from other processes, each worker sets them with sample() instead.
+'''
+import functools
+import os
+import socket
+import time
+from concurrent import futures
+
+from prometheus_client import CollectorRegistry, Counter, Gauge, Histogram, generate_latest, multiprocess
+from prometheus_client.core import GaugeMetricFamily, REGISTRY
+from requests.exceptions import Timeout
+
+# same check as prometheus_client, which picks its value storage on import
+MULTIPROCESS = 'PROMETHEUS_MULTIPROC_DIR' in os.environ or 'prometheus_multiproc_dir' in os.environ
+
+REQUESTS = Counter('adarca_http_requests_total',
+                   'HTTP requests handled by ADARCA.',
+                   ['method', 'endpoint', 'status'])
+REQUEST_LATENCY = Histogram('adarca_http_request_duration_seconds',
+                            'Time to handle an HTTP request.',
+                            ['method', 'endpoint'])
+UPSTREAM_LATENCY = Histogram('adarca_upstream_request_duration_seconds',
+                             'Time spent in calls to an upstream service.',
+                             ['upstream', 'operation'],
+                             buckets=(.025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30))
+UPSTREAM_ERRORS = Counter('adarca_upstream_errors_total',
+                          'Upstream calls that raised an error.',
+                          ['upstream', 'operation', 'error'])
+UPSTREAM_TIMEOUTS = Counter('adarca_upstream_timeouts_total',
+                            'Upstream calls that timed out.',
+                            ['upstream', 'operation'])
+CHECK_LATENCY = Histogram('adarca_check_duration_seconds',
+                          'Time to run a check or one of its probes.',
+                          ['check'])
+
+TIMEOUT_ERRORS = (Timeout, socket.timeout, futures.TimeoutError)
+
+def observe(upstream, operation, fn):
+    '''Wraps fn so every call is timed, and its errors counted, under upstream and operation.'''
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except TIMEOUT_ERRORS:
+            UPSTREAM_TIMEOUTS.labels(upstream, operation).inc()
+            raise
+        except Exception as e:
+            UPSTREAM_ERRORS.labels(upstream, operation, type(e).__name__).inc()
+            raise
+        finally:
+            UPSTREAM_LATENCY.labels(upstream, operation).observe(time.perf_counter() - start)
+    return wrapper
+
+def instrument(obj, upstream, methods):
+    '''Replaces methods of a client instance with observed versions. Returns obj.'''
+    for method in methods:
+        setattr(obj, method, observe(upstream, method, getattr(obj, method)))
+    return obj
+
+def instrument_module(module, names, histogram=CHECK_LATENCY):
+    '''Replaces functions of a module with versions timed by a single-label histogram.'''
+    for name in names:
+        setattr(module, name, _timed(histogram.labels(name), getattr(module, name)))
+
+def _timed(histogram, fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        with histogram.time():
+            return fn(*args, **kwargs)
+    return wrapper
+
+def gauge(name, documentation, fn):
+    '''Registers a gauge whose value is read from fn() at scrape time, or
+    by sample() in multiprocess mode, where the values of workers are summed.
+    '''
+    if MULTIPROCESS:
+        g = Gauge(name, documentation, multiprocess_mode='livesum')
+        SAMPLED.append((g, fn))
+        return g
+    g = Gauge(name, documentation)
+    g.set_function(fn)
+    return g
+
+class CacheCollector:
+    '''Reports hits, misses and hit ratio of caches that count them, e.g. cache.TTLCache.'''
+    def __init__(self):
+        self.caches = {}
+
+    def collect(self):
+        # gauges, like the livesum gauges of multiprocess mode, so both modes report the same series
+        hits = GaugeMetricFamily('adarca_cache_hits', 'Cache lookups that found an entry.', labels=['cache'])
+        misses = GaugeMetricFamily('adarca_cache_misses', 'Cache lookups that found no entry.', labels=['cache'])
+        ratio = GaugeMetricFamily('adarca_cache_hit_ratio', 'Share of cache lookups that found an entry.', labels=['cache'])
+        for name, cache in self.caches.items():
+            total = cache.hits + cache.misses
+            hits.add_metric([name], cache.hits)
+            misses.add_metric([name], cache.misses)
+            ratio.add_metric([name], cache.hits / total if total else 0.0)
+        yield hits
+        yield misses
+        yield ratio
+
+CACHES = CacheCollector()
+# gauges sample() sets in multiprocess mode
+SAMPLED = []
+if MULTIPROCESS:
+    CACHE_HITS = Gauge('adarca_cache_hits', 'Cache lookups that found an entry.', ['cache'], multiprocess_mode='livesum')
+    CACHE_MISSES = Gauge('adarca_cache_misses', 'Cache lookups that found no entry.', ['cache'], multiprocess_mode='livesum')
+else:
+    REGISTRY.register(CACHES)
+
+def register_cache(name, cache):
+    CACHES.caches[name] = cache
+
+def sample():
+    '''Sets the gauges of this worker process in multiprocess mode, called periodically.'''
+    for g, fn in SAMPLED:
+        g.set(fn())
+    for name, cache in CACHES.caches.items():
+        CACHE_HITS.labels(name).set(cache.hits)
+        CACHE_MISSES.labels(name).set(cache.misses)
+
+def mark_dead():
+    '''Drops the gauges of this worker process in multiprocess mode, called on shutdown.'''
+    if MULTIPROCESS:
+        multiprocess.mark_process_dead(os.getpid())
+
+class WorkersCollector:
+    '''Reports the metrics of every worker process, and the cache hit ratios of their summed hits and misses.'''
+    def collect(self):
+        families = list(multiprocess.MultiProcessCollector(None).collect())
+        totals = {}
+        for family in families:
+            if family.name in ('adarca_cache_hits', 'adarca_cache_misses'):
+                for s in family.samples:
+                    totals.setdefault(s.labels['cache'], {})[family.name] = s.value
+        ratio = GaugeMetricFamily('adarca_cache_hit_ratio', 'Share of cache lookups that found an entry.', labels=['cache'])
+        for name, counts in totals.items():
+            total = counts.get('adarca_cache_hits', 0) + counts.get('adarca_cache_misses', 0)
+            ratio.add_metric([name], counts.get('adarca_cache_hits', 0) / total if total else 0.0)
+        yield from families
+        yield ratio
+
+def generate():
+    '''Returns the metrics in the Prometheus text format, of every worker process in multiprocess mode.'''
+    if not MULTIPROCESS:
+        return generate_latest()
+    # this worker's gauges are current, the others' as of their last sample()
+    sample()
+    registry = CollectorRegistry()
+    registry.register(WorkersCollector())
+    return generate_latest(registry)
@@ -1,7 +1,10 @@
+import threading
+import time
+
 import requests
 
 class NetCloudApi:
-    def __init__(self, url, cp_id, cp_key, ecm_id, ecm_key):
+    def __init__(self, url, cp_id, cp_key, ecm_id, ecm_key, session=None, inventory_max_age=None, page_size=500):
         self.url = url if url[-1] != '/' else url[:-1]
         self.auth = {
             'X-CP-API-ID': cp_id,
@@ -9,20 +12,76 @@ class NetCloudApi:
             'X-ECM-API-ID': ecm_id,
             'X-ECM-API-KEY': ecm_key
         }
+        self.session = session or requests.Session()
+        # router name to state index, see refresh_inventory()
+        self.inventory_max_age = inventory_max_age
+        self.page_size = page_size
+        self._states = {}
+        self._inventory_time = None
+        self._inventory_lock = threading.Lock()
+
+    def refresh_inventory(self):
+        '''Pulls the name and state of every router, page by page, so status
+        lookups skip NetCloud while the inventory is younger than inventory_max_age.
+        '''
+        url = self.url + '/routers/'
+        params = {'fields': 'name,state', 'limit': self.page_size}
+        states = {}
+        while url:
+            response = self.session.get(url, params=params, headers=self.auth)
+            response.raise_for_status()
+            payload = response.json()
+            for router in payload['data']:
+                states[router['name']] = router['state']
+            # next page url already carries the query parameters
+            url = payload['meta'].get('next')
+            params = None
+        with self._inventory_lock:
+            self._states = states
+            self._inventory_time = time.monotonic()
+
+    def export_state(self):
+        '''Returns the inventory and when it was refreshed, for load_state() in another process.'''
+        with self._inventory_lock:
+            return {'states': dict(self._states),
+                    'updated': time.time() - (time.monotonic() - self._inventory_time) if self._inventory_time is not None else None}
+
+    def load_state(self, state):
+        '''Replaces the inventory with one from export_state().'''
+        with self._inventory_lock:
+            self._states = state['states']
+            self._inventory_time = time.monotonic() - (time.time() - state['updated']) if state['updated'] is not None else None
+
+    def inventory_is_fresh(self):
+        if self.inventory_max_age is None or self._inventory_time is None:
+            return False
+        return time.monotonic() - self._inventory_time <= self.inventory_max_age
 
     def get_router_status_by_name(self, name):
         '''Returns the status of a given router name in NetCloud.
         '''
 
+        if self.inventory_is_fresh():
+            with self._inventory_lock:
+                state = self._states.get(name)
+            if state is not None:
+                return state == 'online'
+
         url = self.url + '/routers'
         headers = self.auth
-        params = {'name': name}
+        params = {'name': name, 'fields': 'name,state'}
 
         # Send a request to get the router's status.
-        response = requests.get(url, params, headers=headers)
-        
+        response = self.session.get(url, params=params, headers=headers)
+
         # Check if we were able to find the router in NetCloud.
         response.raise_for_status()
-        
+
+        state = response.json()['data'][0]['state']
+        # Add routers missing from the inventory until the next refresh.
+        if self._inventory_time is not None:
+            with self._inventory_lock:
+                self._states[name] = state
+
         # Return the router's status.
-        return response.json()['data'][0]['state'] == 'online'
+        return state == 'online'
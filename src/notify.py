@@ -0,0 +1,200 @@
+import threading
+import time
+from collections import deque
+
+from loguru import logger
+
+class TokenBucket:
+    '''Allows bursts of up to capacity calls, refilled at rate tokens per second.'''
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+
+    def take(self):
+        '''Takes a token, returns False when there is none.'''
+        self._refill()
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+    def wait_time(self):
+        '''Seconds until a token is available.'''
+        self._refill()
+        return max(0.0, (1 - self._tokens) / self.rate)
+
+    def drain(self):
+        '''Spends every token, e.g. when the upstream says the rate limit was hit.'''
+        self._refill()
+        self._tokens = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+class OutageDigest:
+    '''Collects confirmed site outages and publishes one post per provider
+    outage, instead of one per site, from a background thread.
+
+    Outages are grouped by the provider outage they belong to, i.e. matching
+    Power_StartDate and Power_Cause. Outages without either cannot be told
+    apart, so each of their sites gets a group of its own. A group is
+    published window seconds after its first site, through a token bucket so
+    bursts stay under the rate limit of the platform. Each site of a provider
+    outage is published once for repeat_after seconds: sites confirmed after
+    the outage was published go out in a follow-up digest that lists them.
+
+    Parameters
+    ----------
+    publish : callable
+        Called with the text of a digest, e.g. to tweet it.
+    window : float
+        Seconds sites are collected into a group before it is published.
+    rate : float
+        Digests published per second, on average.
+    burst : int
+        Digests that can be published at once.
+    claim : callable
+        Called with the key of a group, and with the key of the group plus a
+        site for each of its sites, before publishing it. Returns False when
+        the key was published already, e.g. by another worker process.
+        Defaults to remembering published keys for repeat_after seconds.
+    repeat_after : float
+        Seconds before the default claim lets a key be published again.
+    rate_limited : tuple
+        Exceptions of publish that mean the rate limit was hit, the digest is
+        published again once the bucket refills.
+    '''
+    def __init__(self, publish, window=60, rate=5/60, burst=5, claim=None, repeat_after=6*60*60, rate_limited=()):
+        self.publish = publish
+        self.window = window
+        self.bucket = TokenBucket(rate, burst)
+        self.claim = claim or self._claim
+        self.repeat_after = repeat_after
+        self.rate_limited = rate_limited
+        self._groups = {}
+        self._outbox = deque()
+        self._published = {}
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def add(self, site_name, details):
+        '''Adds the outage of a site to its group. Does not wait on publishing.'''
+        key = (details.get('Power_StartDate', ''), details.get('Power_Cause', ''))
+        if not any(key):
+            key += (site_name,)
+        with self._lock:
+            group = self._groups.get(key)
+            if group is None:
+                group = self._groups[key] = {'key': key, 'details': dict(details), 'sites': [], 'first': time.monotonic()}
+            if site_name not in group['sites']:
+                group['sites'].append(site_name)
+        self._wake.set()
+        return key
+
+    @property
+    def pending(self):
+        '''Groups waiting for their window to close or to be published.'''
+        with self._lock:
+            return len(self._groups) + len(self._outbox)
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name='outage-digest', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        '''Publishes every group without waiting for its window, as far as the
+        rate limit allows within timeout seconds.
+        '''
+        with self._lock:
+            for group in self._groups.values():
+                group['first'] = -self.window
+        deadline = time.monotonic() + (timeout or 0)
+        while self.pending and time.monotonic() < deadline:
+            self._wake.set()
+            time.sleep(0.1)
+        self._stopped.set()
+        self._wake.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+        if self.pending:
+            logger.warning(f'Dropping {self.pending} unpublished outage digest(s).')
+
+    def _run(self):
+        while not self._stopped.is_set():
+            now = time.monotonic()
+            with self._lock:
+                for key in [key for key, group in self._groups.items() if now - group['first'] >= self.window]:
+                    self._outbox.append(self._groups.pop(key))
+                group = self._outbox.popleft() if self._outbox and self.bucket.take() else None
+                waits = [waiting['first'] + self.window - now for waiting in self._groups.values()]
+                if self._outbox:
+                    waits.append(self.bucket.wait_time())
+            if group is not None:
+                self._send(group)
+                continue
+            self._wake.clear()
+            self._wake.wait(max(0.05, min(waits)) if waits else None)
+
+    def _send(self, group):
+        # claimed once, a digest put back after hitting the rate limit is still ours
+        if 'new_sites' not in group:
+            group['follow_up'] = not self.claim(group['key'])
+            group['new_sites'] = [site for site in group['sites'] if self.claim(group['key'] + (site,))]
+            if not group['new_sites']:
+                logger.info(f'Outage digest of {len(group["sites"])} site(s) was already published.')
+                return
+        try:
+            self.publish(self.render(group))
+        except self.rate_limited as e:
+            logger.warning(f'Rate limited publishing outage digest, retrying. {str(e)}')
+            self.bucket.drain()
+            with self._lock:
+                self._outbox.appendleft(group)
+        except Exception as e:
+            logger.error(f'Failed to publish outage digest of {len(group["new_sites"])} site(s). Cause: {str(e)}')
+        else:
+            skipped = len(group['sites']) - len(group['new_sites'])
+            logger.info(f'Published outage {"follow-up " if group["follow_up"] else ""}digest of {len(group["new_sites"])} site(s)'
+                        + (f', {skipped} were published already.' if skipped else '.'))
+
+    @staticmethod
+    def render(group):
+        details = group['details']
+        sites = group.get('new_sites', group['sites'])
+        if group.get('follow_up'):
+            # names the sites, so follow-ups of the same outage differ
+            shown = ', '.join(sites[:5]) + (f' and {len(sites) - 5} more' if len(sites) > 5 else '')
+            return '\n'.join((
+                'OUTAGE UPDATE',
+                f'Start Date: {details.get("Power_StartDate", "")}',
+                f'Cause: {details.get("Power_Cause", "")}',
+                f'Estimated Restore Date: {details.get("Power_EstimatedRestoreDate", "")}',
+                f'Sites Also Affected: {shown}'))
+        lines = [
+            'OUTAGE DETECTED',
+            f'Start Date: {details.get("Power_StartDate", "")}',
+            f'Type: {details.get("Power_OutageType", "")}',
+            f'Cause: {details.get("Power_Cause", "")}',
+            f'Estimated Restore Date: {details.get("Power_EstimatedRestoreDate", "")}',
+            f'Sites Affected: {len(sites)}']
+        if len(group['key']) > 2:
+            # keyed by site, name it so digests of different sites differ
+            lines.append(f'Site: {group["sites"][0]}')
+        return '\n'.join(lines)
+
+    def _claim(self, key):
+        now = time.monotonic()
+        with self._lock:
+            self._published = {k: t for k, t in self._published.items() if now - t < self.repeat_after}
+            if key in self._published:
+                return False
+            self._published[key] = now
+            return True
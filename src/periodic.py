@@ -0,0 +1,48 @@
+import threading
+
+from loguru import logger
+
+class PeriodicTask:
+    '''Calls fn every interval seconds on a daemon thread. Errors are logged
+    and the next run is still scheduled.
+
+    Parameters
+    ----------
+    name : str
+        Name used for the thread and in logs.
+    interval : float
+        Seconds between the end of one run and the start of the next.
+    fn : callable
+        Function to run, called with no arguments.
+    run_now : bool
+        Run fn as soon as the task starts instead of after the first interval.
+    '''
+    def __init__(self, name, interval, fn, run_now=True):
+        self.name = name
+        self.interval = interval
+        self.fn = fn
+        self.run_now = run_now
+        self._stopped = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=None):
+        self._stopped.set()
+        if self._thread:
+            self._thread.join(timeout)
+            self._thread = None
+
+    def _run(self):
+        if not self.run_now and self._stopped.wait(self.interval):
+            return
+        while True:
+            try:
+                self.fn()
+            except Exception:
+                logger.exception(f'Periodic task {self.name} failed.')
+            if self._stopped.wait(self.interval):
+                return
@@ -3,10 +3,23 @@ from copy import deepcopy
 from datetime import datetime
 
 import pytz
-import requests
 from loguru import logger
 
+import transport
 from config import config
+from .index import OutageIndex, UNIT_TO_METERS
+
+GIS_URL = config["gis-api"].get("url", "https://services.arcgis.com/BLN4oKB0N1YSgvY8/arcgis/rest/services/Power_Outages_(View)/FeatureServer/0/query")
+
+INDEX_CONFIG = config["gis-api"].get("index")
+INDEX = OutageIndex(GIS_URL,
+                    headers=config["gis-api"]["headers"],
+                    params={"where": config["gis-api"]["params"].get("where", "1=1"),
+                            "outFields": config["gis-api"]["params"]["outFields"]},
+                    cell_size=INDEX_CONFIG.get("cell_size", 0.1),
+                    page_size=INDEX_CONFIG.get("page_size", 2000),
+                    session=transport.get_session("gis-api"),
+                    max_age=INDEX_CONFIG.get("max_age", 900)) if INDEX_CONFIG else None
 
 def convert_epoch_to_datetime(epoch):
     """convert epoch to datetime with config-specified timezone
@@ -58,31 +71,19 @@ def get_gis_power_status(site):
         logger.exception("Argument is missing required key: " + err.args[0])
         return None
         
-    url = "https://services.arcgis.com/BLN4oKB0N1YSgvY8/arcgis/rest/services/Power_Outages_(View)/FeatureServer/0/query"
-    headers = deepcopy(config["gis-api"]["headers"])
-    params = deepcopy(config["gis-api"]["params"])
-
-    params["geometry"] = str(site["longitude"]) + "," + str(site["latitude"])
-    params["inSR"] = "4326"
-    params["geometryType"] = "esriGeometryPoint"
-
-    response = requests.get(url, headers=headers, params=params)
-
-    response_content = json.loads(response.content)
-
-    # get list of outages
-    try:
-        statuses = response_content['features']
-    except KeyError:
-        logger.error(response_content)
-        return None
+    if INDEX is not None and INDEX.is_fresh():
+        statuses = _lookup_outages(site)
+    else:
+        statuses = _query_outages(site)
+        if statuses is None:
+            return None
 
     if not statuses:
         return {"PowerStatus": "Active"}
     elif len(statuses) > 1:
         logger.warning("More than one outage found. Using the closest outage...")
 
-    site_status = statuses[0]["attributes"]
+    site_status = statuses[0]
     
     # convert epoch to formatted datetime
     if "StartDate" in site_status:
@@ -96,6 +97,32 @@ def get_gis_power_status(site):
     site_status["PowerStatus"] = "Inactive"
     return site_status
 
+def _query_outages(site):
+    """Queries the GIS layer for outages near a site and returns their attributes."""
+    headers = deepcopy(config["gis-api"]["headers"])
+    params = deepcopy(config["gis-api"]["params"])
+
+    params["geometry"] = str(site["longitude"]) + "," + str(site["latitude"])
+    params["inSR"] = "4326"
+    params["geometryType"] = "esriGeometryPoint"
+
+    response = transport.get_session("gis-api").get(GIS_URL, headers=headers, params=params)
+
+    response_content = json.loads(response.content)
+
+    # get list of outages
+    try:
+        return [feature["attributes"] for feature in response_content['features']]
+    except KeyError:
+        logger.error(response_content)
+        return None
+
+def _lookup_outages(site):
+    """Finds outages near a site in the local outage index, closest first."""
+    params = config["gis-api"]["params"]
+    distance = float(params.get("distance", 0)) * UNIT_TO_METERS[params.get("unit", "esriSRUnit_Meter")]
+    return INDEX.lookup(float(site["longitude"]), float(site["latitude"]), distance)
+
 #function to redirect which function API to call
 def get_site_status(site, provider=None):
     address = ", ".join((site["street"], site["city"], site["state"]))
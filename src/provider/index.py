@@ -0,0 +1,178 @@
+import json
+import math
+import threading
+import time
+from collections import defaultdict
+from copy import deepcopy
+
+import requests
+from loguru import logger
+
+# meters per degree of latitude (and of longitude at the equator)
+METERS_PER_DEGREE = 111320
+
+# conversion of ArcGIS distance units to meters
+UNIT_TO_METERS = {
+    "esriSRUnit_Meter": 1,
+    "esriSRUnit_Kilometer": 1000,
+    "esriSRUnit_Foot": 0.3048,
+    "esriSRUnit_StatuteMile": 1609.344,
+    "esriSRUnit_NauticalMile": 1852,
+    "esriSRUnit_USNauticalMile": 1852
+}
+
+class OutageIndex:
+    """In-memory grid index of every outage in an ArcGIS feature layer, so sites can be
+    checked for nearby outages without querying the layer per site.
+
+    Parameters
+    ----------
+    url : str
+        Query endpoint of the feature layer.
+    headers : dict
+        Headers sent with each download request.
+    params : dict
+        Query parameters of the download, e.g. where and outFields.
+    cell_size : float
+        Size, in degrees, of each grid cell.
+    page_size : int
+        Features requested per page, at most the layer's maxRecordCount.
+    max_age : int
+        Seconds a download is used before lookups fall back to querying the layer.
+    session : requests.Session
+        Session used to download the layer, defaults to a new one.
+    """
+
+    def __init__(self, url, headers=None, params=None, cell_size=0.1, page_size=2000, max_age=900, session=None):
+        self.url = url
+        self.headers = headers
+        self.params = params or {}
+        self.cell_size = cell_size
+        self.page_size = page_size
+        self.max_age = max_age
+        self.session = session or requests.Session()
+        self._outages = []
+        self._grid = {}
+        self._updated = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self._updated is not None and time.monotonic() - self._updated <= self.max_age
+
+    def refresh(self):
+        """Downloads every feature of the layer, page by page, and rebuilds the index."""
+        features = []
+        offset = 0
+        while True:
+            params = deepcopy(self.params)
+            params.update({
+                "f": "json",
+                "returnGeometry": "true",
+                "outSR": "4326",
+                "resultOffset": offset,
+                "resultRecordCount": self.page_size
+            })
+            response = self.session.get(self.url, headers=self.headers, params=params)
+            response.raise_for_status()
+            content = json.loads(response.content)
+            if "features" not in content:
+                raise ValueError(f"Cannot parse outage features: {content}")
+            features.extend(content["features"])
+            if not content.get("exceededTransferLimit") or not content["features"]:
+                break
+            offset += len(content["features"])
+
+        outages = []
+        grid = defaultdict(list)
+        for feature in features:
+            parts = _geometry_parts(feature.get("geometry"))
+            if not parts:
+                continue
+            xs = [x for part in parts for x, _ in part]
+            ys = [y for part in parts for _, y in part]
+            outages.append((feature["attributes"], parts))
+            for cell in self._cells(min(xs), min(ys), max(xs), max(ys)):
+                grid[cell].append(len(outages) - 1)
+        with self._lock:
+            self._outages = outages
+            self._grid = dict(grid)
+            self._updated = time.monotonic()
+        logger.info(f"Indexed {len(outages)} outage(s).")
+
+    def export_state(self):
+        """Returns the index and when it was refreshed, for load_state() in another process."""
+        with self._lock:
+            return {"outages": self._outages, "grid": self._grid,
+                    "updated": time.time() - (time.monotonic() - self._updated) if self._updated is not None else None}
+
+    def load_state(self, state):
+        """Replaces the index with one from export_state()."""
+        with self._lock:
+            self._outages = state["outages"]
+            self._grid = state["grid"]
+            self._updated = time.monotonic() - (time.time() - state["updated"]) if state["updated"] is not None else None
+
+    def lookup(self, long, lat, distance):
+        """Finds outages within distance, in meters, of a point.
+
+        Returns
+        -------
+        list
+            Copies of the attributes of each outage found, closest first.
+        """
+        d_lat = distance / METERS_PER_DEGREE
+        d_long = distance / (METERS_PER_DEGREE * max(math.cos(math.radians(lat)), 1e-6))
+        with self._lock:
+            outages, grid = self._outages, self._grid
+        candidates = set()
+        for cell in self._cells(long - d_long, lat - d_lat, long + d_long, lat + d_lat):
+            candidates.update(grid.get(cell, ()))
+        found = []
+        for i in candidates:
+            attributes, parts = outages[i]
+            meters = _distance_to(long, lat, parts)
+            if meters <= distance:
+                found.append((meters, i, attributes))
+        found.sort()
+        return [deepcopy(attributes) for _, _, attributes in found]
+
+    def _cells(self, min_x, min_y, max_x, max_y):
+        for i in range(math.floor(min_x / self.cell_size), math.floor(max_x / self.cell_size) + 1):
+            for j in range(math.floor(min_y / self.cell_size), math.floor(max_y / self.cell_size) + 1):
+                yield i, j
+
+def _geometry_parts(geometry):
+    """Returns the rings of a polygon, or a point as a single one-vertex part."""
+    if not geometry:
+        return None
+    if "rings" in geometry:
+        return [ring for ring in geometry["rings"] if ring]
+    if "x" in geometry and "y" in geometry and geometry["x"] is not None:
+        return [[(geometry["x"], geometry["y"])]]
+    return None
+
+def _distance_to(long, lat, parts):
+    """Distance in meters from a point to a polygon (0 if inside) or to a point feature.
+    Uses an equirectangular projection around the point, accurate at outage distances.
+    """
+    scale_x = METERS_PER_DEGREE * math.cos(math.radians(lat))
+    projected = [[((x - long) * scale_x, (y - lat) * METERS_PER_DEGREE) for x, y in part] for part in parts]
+    if len(projected) == 1 and len(projected[0]) == 1:
+        x, y = projected[0][0]
+        return math.hypot(x, y)
+    # even-odd rule over all rings also excludes holes
+    inside = False
+    closest = math.inf
+    for ring in projected:
+        for (x1, y1), (x2, y2) in zip(ring, ring[1:] + ring[:1]):
+            if (y1 > 0) != (y2 > 0) and 0 < x1 + (0 - y1) * (x2 - x1) / (y2 - y1):
+                inside = not inside
+            closest = min(closest, _distance_to_segment(x1, y1, x2, y2))
+    return 0 if inside else closest
+
+def _distance_to_segment(x1, y1, x2, y2):
+    """Distance from the origin to the segment (x1, y1)-(x2, y2)."""
+    dx, dy = x2 - x1, y2 - y1
+    length = dx * dx + dy * dy
+    t = 0 if length == 0 else max(0, min(1, -(x1 * dx + y1 * dy) / length))
+    return math.hypot(x1 + t * dx, y1 + t * dy)
@@ -0,0 +1,117 @@
+import json
+import sqlite3
+import threading
+import time
+
+class ResultStore:
+    '''On-disk history of outage and warranty check results, indexed by site
+    and time.
+
+    Every evaluation is recorded, so a check of a site that was checked a
+    moment ago can reuse the recent result instead of querying the upstreams,
+    and the history and outage timeline of a site can be looked up.
+
+    Parameters
+    ----------
+    path : str
+        Path of the SQLite database file.
+    retention : int
+        Seconds a result is kept before prune() removes it.
+    '''
+    def __init__(self, path, retention=30*24*60*60):
+        self.retention = retention
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, timeout=10, check_same_thread=False)
+        with self._db:
+            # readers do not block the writer of another worker process
+            self._db.execute('PRAGMA journal_mode=WAL')
+            self._db.execute('''CREATE TABLE IF NOT EXISTS results (
+                id INTEGER PRIMARY KEY,
+                kind TEXT NOT NULL,
+                site TEXT NOT NULL,
+                subject TEXT NOT NULL,
+                verdict TEXT,
+                details TEXT,
+                checked REAL NOT NULL)''')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_site ON results (site, kind, subject, checked)')
+            self._db.execute('CREATE INDEX IF NOT EXISTS results_checked ON results (checked)')
+
+    def record(self, kind, site, details, verdict=None, subject=''):
+        '''Records the result of a check of a site, kind being outage or
+        warranty. subject tells checks of the same kind and site apart, e.g.
+        the configuration item of a warranty check. details must be JSON
+        serializable.
+        '''
+        with self._lock, self._db:
+            self._db.execute('INSERT INTO results (kind, site, subject, verdict, details, checked) VALUES (?, ?, ?, ?, ?, ?)',
+                             (kind, site, subject, verdict, json.dumps(details), time.time()))
+
+    def recent(self, kind, site, max_age, subject=''):
+        '''Returns the newest result of a check, as a dict, if it is at most max_age seconds old, or None.'''
+        with self._lock:
+            row = self._db.execute('SELECT kind, site, subject, verdict, details, checked FROM results '
+                                   'WHERE site = ? AND kind = ? AND subject = ? AND checked >= ? '
+                                   'ORDER BY checked DESC LIMIT 1',
+                                   (site, kind, subject, time.time() - max_age)).fetchone()
+        return self._entry(row) if row else None
+
+    def history(self, site, kind=None, since=None, until=None, limit=100):
+        '''Returns the results of a site, newest first, optionally of one kind and between since and until.'''
+        query = 'SELECT kind, site, subject, verdict, details, checked FROM results WHERE site = ?'
+        params = [site]
+        if kind:
+            query += ' AND kind = ?'
+            params.append(kind)
+        if since is not None:
+            query += ' AND checked >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND checked <= ?'
+            params.append(until)
+        query += ' ORDER BY checked DESC LIMIT ?'
+        params.append(limit)
+        with self._lock:
+            rows = self._db.execute(query, params).fetchall()
+        return [self._entry(row) for row in rows]
+
+    def timeline(self, site, since=None, until=None):
+        '''Returns the power verdicts of a site over time, oldest first, as
+        periods of consecutive outage checks with the same verdict.
+        '''
+        query = "SELECT verdict, checked FROM results WHERE site = ? AND kind = 'outage' AND subject = ''"
+        params = [site]
+        if since is not None:
+            query += ' AND checked >= ?'
+            params.append(since)
+        if until is not None:
+            query += ' AND checked <= ?'
+            params.append(until)
+        with self._lock:
+            rows = self._db.execute(query + ' ORDER BY checked', params).fetchall()
+        periods = []
+        for verdict, checked in rows:
+            if periods and periods[-1]['verdict'] == verdict:
+                periods[-1]['last_checked'] = checked
+                periods[-1]['checks'] += 1
+            else:
+                if periods:
+                    periods[-1]['end'] = checked
+                periods.append({'verdict': verdict, 'start': checked, 'last_checked': checked, 'end': None, 'checks': 1})
+        return periods
+
+    def prune(self):
+        '''Removes results older than retention seconds.'''
+        with self._lock, self._db:
+            self._db.execute('DELETE FROM results WHERE checked < ?', (time.time() - self.retention,))
+
+    @staticmethod
+    def _entry(row):
+        kind, site, subject, verdict, details, checked = row
+        return {
+            'kind': kind,
+            'site': site,
+            'subject': subject,
+            'verdict': verdict,
+            'details': json.loads(details),
+            'checked': checked
+        }
@@ -0,0 +1,125 @@
+import threading
+import time
+import xml.etree.ElementTree as ET
+from collections import defaultdict
+
+import requests
+from loguru import logger
+from prtg import PrtgApi
+from prtg.exception import Unauthorized
+
+class SessionPrtgApi(PrtgApi):
+    '''prtg.PrtgApi that sends its requests through session, e.g. a
+    transport.Session with a timeout, instead of requests.get, which waits on
+    PRTG without one.
+
+    Parameters
+    ----------
+    session : requests.Session
+        Session used for every request, defaults to a new one.
+    '''
+    def __init__(self, url, username, password, session=None, **kwargs):
+        # the constructor validates the credentials with a request
+        self.session = session or requests.Session()
+        super().__init__(url, username, password, **kwargs)
+
+    def _requests_get(self, endpoint, params=None):
+        # same as PrtgApi._requests_get(), but through self.session
+        key = 'passhash' if self.is_passhash else 'password'
+        auth = {'username': self.username, key: self.password}
+        if params:
+            auth.update(params)
+        response = self.session.get(self.url + endpoint, params=auth)
+        try:
+            response.raise_for_status()
+        except requests.HTTPError as e:
+            if response.status_code == 400:
+                raise requests.HTTPError(ET.fromstring(response.text).find('error').text)
+            elif response.status_code == 401:
+                raise Unauthorized('Authentication failed for PRTG API.')
+            elif response.status_code == 404:
+                raise requests.HTTPError('Content not found.')
+            raise requests.HTTPError(e)
+        return response
+
+class SensorSnapshot:
+    '''In-memory copy of the PRTG sensor table, pulled in one paginated query,
+    that answers get_sensors_by_name() like prtg.PrtgApi does.
+
+    Sensors are indexed by (device, name) and filtered by group, which like the
+    PRTG filter_group=@sub() query matches when the group name contains it.
+    Lookups fall back to prtg_api when the snapshot is older than max_age or
+    has no matching sensor.
+
+    Parameters
+    ----------
+    prtg_api : prtg.PrtgApi
+        Client used for credentials and live lookups.
+    session : requests.Session
+        Session used to pull the sensor table, defaults to a new one.
+    page_size : int
+        Sensors requested per page.
+    max_age : int
+        Seconds a snapshot is used before falling back to live lookups.
+    '''
+    COLUMNS = 'objid,probe,group,device,status,priority,active,name'
+
+    def __init__(self, prtg_api, session=None, page_size=2500, max_age=120):
+        self.prtg_api = prtg_api
+        self.session = session or requests.Session()
+        self.page_size = page_size
+        self.max_age = max_age
+        self._index = {}
+        self._updated = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self._updated is not None and time.monotonic() - self._updated <= self.max_age
+
+    def refresh(self):
+        '''Pulls every sensor from PRTG, page by page, and rebuilds the index.'''
+        key = 'passhash' if self.prtg_api.is_passhash else 'password'
+        sensors = []
+        while True:
+            params = {
+                'content': 'sensors',
+                'columns': self.COLUMNS,
+                'count': self.page_size,
+                'start': len(sensors),
+                'username': self.prtg_api.username,
+                key: self.prtg_api.password
+            }
+            response = self.session.get(self.prtg_api.url + '/api/table.json', params=params)
+            response.raise_for_status()
+            payload = response.json()
+            page = payload['sensors']
+            sensors.extend(page)
+            if len(page) < self.page_size or len(sensors) >= payload.get('treesize', 0):
+                break
+        index = defaultdict(list)
+        for sensor in sensors:
+            index[(sensor.get('device'), sensor.get('name'))].append(sensor)
+        with self._lock:
+            self._index = dict(index)
+            self._updated = time.monotonic()
+        logger.info(f'Indexed {len(sensors)} PRTG sensor(s).')
+
+    def export_state(self):
+        '''Returns the index and when it was refreshed, for load_state() in another process.'''
+        with self._lock:
+            return {'index': self._index, 'updated': time.time() - (time.monotonic() - self._updated) if self._updated is not None else None}
+
+    def load_state(self, state):
+        '''Replaces the index with one from export_state().'''
+        with self._lock:
+            self._index = state['index']
+            self._updated = time.monotonic() - (time.time() - state['updated']) if state['updated'] is not None else None
+
+    def get_sensors_by_name(self, name, group=None, device=None):
+        if device is not None and self.is_fresh():
+            with self._lock:
+                candidates = self._index.get((device, name), [])
+            sensors = [s for s in candidates if not group or group in s.get('group', '')]
+            if sensors:
+                return sensors
+        return self.prtg_api.get_sensors_by_name(name, group, device)
@@ -1 +1,2 @@
-from .api import SnowApi
\ No newline at end of file
+from .api import SnowApi
+from .mirror import CmdbMirror
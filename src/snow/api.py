@@ -1,28 +1,110 @@
+import base64
+import json
+import uuid
+from urllib.parse import urlparse
+
 import pysnow
 import requests
 
 class SnowApi:
-    def __init__(self, instance, username, password, limit=10000, offset=0, display_value=False):
-        self.client = pysnow.Client(instance=instance, user=username, password=password)
+    def __init__(self, instance, username, password, limit=10000, offset=0, display_value=False, session=None, record_cache=None, host=None, use_ssl=True, site_cache=None):
+        if session is None:
+            session = requests.Session()
+        session.auth = (username, password)
+        self.session = session
+        # host, e.g. 'localhost:8000', replaces the instance's service-now.com host when given
+        if host:
+            self.client = pysnow.Client(host=host, use_ssl=use_ssl, session=session)
+        else:
+            self.client = pysnow.Client(instance=instance, use_ssl=use_ssl, session=session)
         self.client.parameters.limit = limit
         self.client.parameters.offset = offset
         self.client.parameters.display_value = display_value
         self.instance = instance
         self.username = username
         self.password = password
+        # optional cache.TTLCache of reference records, see get_record()
+        self.record_cache = record_cache
+        # optional cache of locations by name, see get_site_by_name()
+        self.site_cache = site_cache
+        # optional snow.CmdbMirror answering location and CI reads
+        self.mirror = None
 
     def get_site_by_name(self, name):
+        if self.mirror is not None:
+            site = self.mirror.get_site(name)
+            if site is not None:
+                return site
+        if self.site_cache is not None:
+            site = self.site_cache.get(name)
+            if site is not None:
+                return site
         location_table = self.client.resource(api_path='/table/cmn_location')
-        return location_table.get(query={'name': name}).one()
+        site = location_table.get(query={'name': name}).one()
+        if self.site_cache is not None:
+            self.site_cache.set(name, site)
+        return site
 
-    def get_cis_filtered_by(self, filters):
-        ci_table = self.client.resource(api_path='/table/cmdb_ci')
+    def get_sites_missing_long_lat(self, fields=None, page_size=None):
+        '''Returns every location missing a longitude or latitude, fetched page by
+        page so the client limit does not cut the list short. The whole list is
+        read before returning, as updating a location moves it out of later pages.
+        '''
+        return list(self.iter_records('cmn_location', 'longitudeISEMPTY^ORlatitudeISEMPTY', fields=fields, page_size=page_size))
+
+    def iter_sites_filtered_by(self, filters, fields=None, page_size=None):
+        '''Yields locations matching filters, e.g. {'state': ['CA'], 'city': ['Irvine', 'Tustin']},
+        one page at a time. Served from the CMDB mirror when it has a match.
+        '''
+        if self.mirror is not None:
+            sites = self.mirror.find_sites(filters, fields=fields)
+            if sites:
+                yield from sites
+                return
+        yield from self.iter_records('cmn_location', self._build_query(filters), fields=fields, page_size=page_size)
+
+    def get_cis_filtered_by(self, filters, fields=None, page_size=None):
+        return list(self.iter_cis_filtered_by(filters, fields=fields, page_size=page_size))
+
+    def iter_cis_filtered_by(self, filters, fields=None, page_size=None):
+        '''Yields configuration items matching filters, e.g. {'name': ['AP', '']}
+        for name AP or empty, one page at a time.
 
+        Pages are requested and parsed lazily, so a caller that stops iterating
+        once it has found its match never fetches the remaining pages. fields
+        limits the returned columns (sysparm_fields), page_size defaults to the
+        client limit. Served from the CMDB mirror when it has a match.
+        '''
+        if self.mirror is not None:
+            cis = self.mirror.find_cis(filters, fields=fields)
+            if cis:
+                yield from cis
+                return
+        yield from self.iter_records('cmdb_ci', self._build_query(filters), fields=fields, page_size=page_size)
+
+    def iter_records(self, table, query='', fields=None, page_size=None):
+        '''Yields the records of a table matching an encoded query, one page at a time.'''
+        resource = self.client.resource(api_path=f'/table/{table}')
+        # stable order so records do not shift between pages
+        query = f'{query}^ORDERBYsys_id' if query else 'ORDERBYsys_id'
+        page_size = page_size or self.client.parameters.limit
+        offset = 0
+        while True:
+            # buffered, so the connection goes back to the pool even when the caller stops early
+            records = list(resource.get(query=query, limit=page_size, offset=offset, fields=list(fields or [])).all())
+            yield from records
+            if len(records) < page_size:
+                return
+            offset += page_size
+
+    @staticmethod
+    def _build_query(filters):
+        '''Returns the encoded query of filters, OR within a field and AND across fields.'''
         copy_filters = filters.copy()
         try:
             first_k, first_v = copy_filters.popitem()
         except KeyError:
-            return ci_table.get().all()
+            return ''
         # first query
         query = pysnow.QueryBuilder().field(first_k)
         if first_v[0]:
@@ -48,8 +130,7 @@ class SnowApi:
                     query.equals(v[i])
                 else:
                     query.is_empty()
-        response = ci_table.get(query=query)
-        return response.all()
+        return str(query)
 
     def set_long_lat(self, sys_id, long, lat):
         update = {
@@ -58,6 +139,12 @@ class SnowApi:
         }
         ci_table = self.client.resource(api_path='/table/cmn_location')
         location = ci_table.update(query={'sys_id': sys_id}, payload=update)
+        self._invalidate_record(sys_id)
+        if self.site_cache is not None:
+            # keyed by name, which the update does not tell, geocoding is rare enough to start over
+            self.site_cache.clear()
+        if self.mirror is not None:
+            self.mirror.patch('cmn_location', sys_id, update)
         return location
 
     def create_incident(self, customer, caller, opened_by, message, description, impact, location, ci=''):
@@ -82,12 +169,73 @@ class SnowApi:
         update = {name: value}
         ci_table = self.client.resource(api_path='/table/cmdb_ci')
         response = ci_table.update(query={'sys_id': sys_id}, payload=update)
+        self._invalidate_record(sys_id)
+        if self.mirror is not None:
+            self.mirror.patch('cmdb_ci', sys_id, update)
         return response[name] == value
 
-    def get_record(self, link):
-        response = requests.get(link, auth=(self.username, self.password))
+    def set_fields(self, table, updates, batch_size=100):
+        '''Updates many records at once through the ServiceNow Batch API.
+
+        Parameters
+        ----------
+        table : str
+            Table of the records, e.g. cmdb_ci.
+        updates : dict
+            Fields to update, keyed by sys_id, e.g. {sys_id: {'warranty_expiration': '2025-01-01'}}.
+        batch_size : int
+            Updates sent per batch request.
+
+        Returns
+        -------
+        list
+            sys_ids of the records that could not be updated.
+        '''
+        url = self.client.base_url + '/api/now/v1/batch'
+        headers = [{'name': 'Content-Type', 'value': 'application/json'},
+                   {'name': 'Accept', 'value': 'application/json'}]
+        items = list(updates.items())
+        failed = []
+        for start in range(0, len(items), batch_size):
+            rest_requests = [{
+                'id': sys_id,
+                'method': 'PATCH',
+                'url': f'/api/now/table/{table}/{sys_id}',
+                'headers': headers,
+                'body': base64.b64encode(json.dumps(fields).encode()).decode()
+            } for sys_id, fields in items[start:start + batch_size]]
+            response = self.session.post(url, json={'batch_request_id': uuid.uuid4().hex, 'rest_requests': rest_requests})
+            response.raise_for_status()
+            payload = response.json()
+            failed.extend(r['id'] for r in payload.get('serviced_requests', []) if r['status_code'] >= 400)
+            failed.extend(r if isinstance(r, str) else r['id'] for r in payload.get('unserviced_requests', []))
+        for sys_id, fields in updates.items():
+            self._invalidate_record(sys_id)
+            if self.mirror is not None and sys_id not in failed:
+                self.mirror.patch(table, sys_id, fields)
+        return failed
+
+    def get_record(self, link, fields=None):
+        '''Returns the record of a reference link, e.g. ci['manufacturer']['link'],
+        optionally with only the given fields. Records are served from record_cache
+        when one is set, so treat them as read-only.
+        '''
+        key = (link, tuple(fields) if fields else None)
+        if self.record_cache is not None:
+            record = self.record_cache.get(key)
+            if record is not None:
+                return record
+        params = {'sysparm_fields': ','.join(fields)} if fields else None
+        response = self.session.get(link, params=params)
         response.raise_for_status()
-        return response.json()['result']
+        record = response.json()['result']
+        if self.record_cache is not None:
+            self.record_cache.set(key, record)
+        return record
+
+    def _invalidate_record(self, sys_id):
+        if self.record_cache is not None:
+            self.record_cache.invalidate(lambda key: urlparse(key[0]).path.rstrip('/').endswith('/' + sys_id))
 
     def get_incident_link(self, sys_id):
-        return f'https://{self.instance}.service-now.com/incident?sys_id={sys_id}'
+        return f'{self.client.base_url}/incident?sys_id={sys_id}'
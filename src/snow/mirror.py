@@ -0,0 +1,187 @@
+import copy
+import threading
+import time
+from collections import defaultdict
+
+from loguru import logger
+
+class CmdbMirror:
+    '''In-memory copy of the CMDB locations (cmn_location) and configuration
+    items (cmdb_ci) alerts read, so SnowApi can answer site and CI lookups
+    without a ServiceNow round trip.
+
+    sync() bulk loads both tables the first time, and every full_interval
+    seconds after that to drop deleted records. In between it only pulls the
+    records updated since the newest sys_updated_on it has seen. Locations are
+    indexed by name, CIs by name, location and sys_class_name. Lookups return
+    None, so SnowApi falls back to ServiceNow, when the mirror is older than
+    max_age or cannot evaluate the filter.
+
+    Parameters
+    ----------
+    snow_api : snow.SnowApi
+        Client used to pull the tables.
+    page_size : int
+        Records per page.
+    max_age : int
+        Seconds since the last successful sync the mirror is used for lookups.
+    full_interval : int
+        Seconds between bulk loads.
+    '''
+    LOCATION_FIELDS = ['sys_id', 'name', 'street', 'city', 'state', 'zip', 'longitude', 'latitude', 'sys_updated_on']
+    CI_FIELDS = ['sys_id', 'name', 'sys_class_name', 'serial_number', 'mac_address', 'manufacturer',
+                 'manufacturer.name', 'location', 'warranty_expiration', 'sys_updated_on']
+    # filters answered from an index, most selective first
+    CI_INDEXES = ('name', 'location.name', 'sys_class_name')
+
+    def __init__(self, snow_api, page_size=1000, max_age=900, full_interval=24*60*60):
+        self.snow_api = snow_api
+        self.page_size = page_size
+        self.max_age = max_age
+        self.full_interval = full_interval
+        self._locations = {}
+        self._cis = {}
+        self._sites_by_name = {}
+        self._indexes = {}
+        self._watermark = None
+        self._loaded = None
+        self._synced = None
+        self._lock = threading.Lock()
+
+    def is_fresh(self):
+        return self._synced is not None and time.monotonic() - self._synced <= self.max_age
+
+    def sync(self):
+        '''Bulk loads the mirror, or applies the records updated since the last sync.'''
+        if self._loaded is None or time.monotonic() - self._loaded >= self.full_interval:
+            self._load()
+        else:
+            self._apply_changes()
+        self._synced = time.monotonic()
+
+    def export_state(self):
+        '''Returns the mirrored tables, their watermark and when the mirror was
+        last synced and bulk loaded, for load_state() in another process.
+        '''
+        with self._lock:
+            return {'locations': self._locations, 'cis': self._cis, 'watermark': self._watermark,
+                    'synced': _wall_time(self._synced), 'loaded': _wall_time(self._loaded)}
+
+    def load_state(self, state):
+        '''Replaces the mirror with one from export_state(). Later syncs only
+        pull the changes since its watermark.
+        '''
+        with self._lock:
+            self._locations = state['locations']
+            self._cis = state['cis']
+            self._reindex()
+            self._watermark = state['watermark']
+        self._loaded = _monotonic_time(state['loaded'])
+        self._synced = _monotonic_time(state['synced'])
+
+    def _load(self):
+        logger.info('Loading CMDB locations and configuration items...')
+        locations = {r['sys_id']: r for r in self.snow_api.iter_records(
+            'cmn_location', fields=self.LOCATION_FIELDS, page_size=self.page_size)}
+        cis = {r['sys_id']: r for r in self.snow_api.iter_records(
+            'cmdb_ci', fields=self.CI_FIELDS, page_size=self.page_size)}
+        watermark = max((r.get('sys_updated_on') or '' for r in (*locations.values(), *cis.values())), default=None)
+        with self._lock:
+            self._locations = locations
+            self._cis = cis
+            self._reindex()
+            self._watermark = watermark
+        self._loaded = time.monotonic()
+        logger.info(f'Loaded {len(locations)} location(s) and {len(cis)} configuration item(s).')
+
+    def _apply_changes(self):
+        # >= so records updated in the same second as the watermark are not missed
+        query = f'sys_updated_on>={self._watermark}' if self._watermark else ''
+        locations = list(self.snow_api.iter_records('cmn_location', query, fields=self.LOCATION_FIELDS, page_size=self.page_size))
+        cis = list(self.snow_api.iter_records('cmdb_ci', query, fields=self.CI_FIELDS, page_size=self.page_size))
+        with self._lock:
+            for location in locations:
+                self._locations[location['sys_id']] = location
+            for ci in cis:
+                self._cis[ci['sys_id']] = ci
+            # a location rename moves its CIs in the location.name index
+            self._reindex()
+            self._watermark = max([r.get('sys_updated_on') or '' for r in locations + cis] + [self._watermark or ''])
+        logger.debug(f'Applied {len(locations)} location and {len(cis)} configuration item change(s) to the CMDB mirror.')
+
+    def _reindex(self):
+        self._sites_by_name = {r['name']: r for r in self._locations.values()}
+        indexes = {key: defaultdict(set) for key in self.CI_INDEXES}
+        for sys_id, ci in self._cis.items():
+            for key in self.CI_INDEXES:
+                indexes[key][self._value(ci, key)].add(sys_id)
+        self._indexes = indexes
+
+    def _value(self, ci, key):
+        if key == 'location.name':
+            location = self._locations.get(self._value(ci, 'location'))
+            return location['name'] if location else ''
+        value = ci.get(key, '')
+        return value.get('value', '') if isinstance(value, dict) else value
+
+    def get_site(self, name):
+        '''Returns a copy of the location named name, or None.'''
+        if not self.is_fresh():
+            return None
+        with self._lock:
+            site = self._sites_by_name.get(name)
+            return copy.deepcopy(site) if site else None
+
+    def find_sites(self, filters, fields=None):
+        '''Returns copies of the locations matching filters like SnowApi.iter_sites_filtered_by,
+        or None when the filters use a field that is not mirrored.
+        '''
+        if not self.is_fresh() or any(key not in self.LOCATION_FIELDS for key in filters):
+            return None
+        with self._lock:
+            if 'name' in filters:
+                candidates = [self._sites_by_name[name] for name in filters['name'] if name in self._sites_by_name]
+            else:
+                candidates = sorted(self._locations.values(), key=lambda r: r['sys_id'])
+            matches = [site for site in candidates
+                       if all((site.get(key) or '') in [v or '' for v in values] for key, values in filters.items())]
+            if fields:
+                return [{field: copy.deepcopy(site.get(field, '')) for field in fields} for site in matches]
+            return copy.deepcopy(matches)
+
+    def find_cis(self, filters, fields=None):
+        '''Returns copies of the CIs matching filters like SnowApi.get_cis_filtered_by,
+        or None when the filters use a field that is not mirrored.
+        '''
+        if not self.is_fresh():
+            return None
+        if any(key not in self.CI_FIELDS and key not in self.CI_INDEXES for key in filters):
+            return None
+        with self._lock:
+            indexed = [key for key in self.CI_INDEXES if key in filters]
+            if indexed:
+                candidates = set().union(*(self._indexes[indexed[0]].get(v or '', ()) for v in filters[indexed[0]]))
+            else:
+                candidates = self._cis.keys()
+            matches = [self._cis[sys_id] for sys_id in sorted(candidates)
+                       if all(self._value(self._cis[sys_id], key) in [v or '' for v in values]
+                              for key, values in filters.items())]
+            if fields:
+                return [{field: copy.deepcopy(ci.get(field, '')) for field in fields} for ci in matches]
+            return copy.deepcopy(matches)
+
+    def patch(self, table, sys_id, fields):
+        '''Applies an update ADARCA made in ServiceNow, so it is seen before the next sync.'''
+        with self._lock:
+            records = self._locations if table == 'cmn_location' else self._cis if table == 'cmdb_ci' else {}
+            if sys_id in records:
+                # in place, so the name index sees the change too
+                records[sys_id].update(fields)
+                if any(key in fields for key in ('name', 'location', 'sys_class_name')):
+                    self._reindex()
+
+def _wall_time(monotonic):
+    return time.time() - (time.monotonic() - monotonic) if monotonic is not None else None
+
+def _monotonic_time(wall):
+    return time.monotonic() - (time.time() - wall) if wall is not None else None
@@ -0,0 +1,52 @@
+import json
+from concurrent import futures
+from typing import Dict, List
+
+from loguru import logger
+from pydantic import BaseModel
+
+class SweepRequest(BaseModel):
+    # sites to check by name
+    site_names: List[str] = []
+    # or every location matching these cmn_location fields, e.g. {'state': ['CA']}
+    filters: Dict[str, List[str]] = {}
+
+def stream(items, evaluate, warmups=(), workers=8):
+    '''Evaluates items on a bounded pool of threads and yields one NDJSON line
+    per item, in the order they finish.
+
+    Parameters
+    ----------
+    items : list
+        (name, item) tuples, the name identifies the item in its result line.
+    evaluate : callable
+        Called with an item, returns a JSON serializable result.
+    warmups : list
+        (name, is_fresh, refresh) tuples of snapshots to refresh once, when
+        stale, before any item is evaluated so items share one bulk lookup.
+    workers : int
+        Items evaluated at the same time.
+    '''
+    executor = futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='sweep')
+    submitted = {}
+    try:
+        stale = [(name, executor.submit(refresh)) for name, is_fresh, refresh in warmups if not is_fresh()]
+        for name, future in stale:
+            try:
+                future.result()
+            except Exception as e:
+                logger.warning(f'Failed to refresh {name} before sweep, sites will be checked live. Cause: {str(e)}')
+        submitted = {executor.submit(evaluate, item): name for name, item in items}
+        for future in futures.as_completed(submitted):
+            name = submitted[future]
+            try:
+                line = {'site_name': name, 'details': future.result()}
+            except Exception as e:
+                logger.error(f'Failed to check site {name}. Cause: {str(e)}')
+                line = {'site_name': name, 'error': str(e) or type(e).__name__}
+            yield json.dumps(line) + '\n'
+    finally:
+        # stop queued work when the client goes away
+        for future in submitted:
+            future.cancel()
+        executor.shutdown(wait=False)
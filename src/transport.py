@@ -0,0 +1,146 @@
+'''Shared HTTP sessions for upstream clients.
+
+Each client gets a long-lived requests.Session, keyed by name, so connections
+are pooled per host and kept alive between webhooks. Pool sizes, the default
+timeout and the retry policy come from the 'http' section of config.yaml, with
+optional overrides per client under 'http.clients.<name>'.
+
+Requests are cut short when the deadline budget of the check sending them (see
+deadline) runs out, and fail fast while the circuit breaker of their upstream
+(see breaker) is open.
+'''
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+import breaker as _breaker
+import deadline
+import metrics
+from config import config
+
+DEFAULTS = {
+    # number of hosts to keep a connection pool for
+    'pool_connections': 10,
+    # connections kept alive per host
+    'pool_maxsize': 10,
+    # seconds, or [connect, read] seconds
+    'timeout': 10,
+    'retries': {
+        'total': 3,
+        'backoff_factor': 0.5,
+        'status_forcelist': [429, 500, 502, 503, 504]
+    },
+    'breaker': {
+        # consecutive failures (connection errors, timeouts, 5xx) that cut an upstream off
+        'failures': 5,
+        # seconds before a trial request is let through
+        'reset_timeout': 30
+    }
+}
+
+_sessions = {}
+_lock = threading.Lock()
+
+class Session(requests.Session):
+    '''requests.Session that applies a default timeout to every request, caps
+    it at the remaining deadline budget, goes through the circuit breaker of
+    the upstream and reports its requests under the upstream name in metrics.
+    '''
+    def __init__(self, name=None, timeout=None, circuit=None):
+        super().__init__()
+        self.name = name
+        self.timeout = timeout
+        self.circuit = circuit
+
+    def request(self, method, url, **kwargs):
+        left = deadline.check(f'{method} {self.name or url}')
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        capped = left is not None and kwargs['timeout'] != _cap(kwargs['timeout'], left)
+        if capped:
+            kwargs['timeout'] = _cap(kwargs['timeout'], left)
+        send = super().request if self.name is None else metrics.observe(self.name, method.upper(), super().request)
+        if self.circuit is None:
+            return self._count_error(method, send(method, url, **kwargs))
+        self.circuit.before()
+        try:
+            response = send(method, url, **kwargs)
+        except Exception as e:
+            if capped and deadline.remaining() <= 0:
+                # timed out because the budget ran out, which says nothing about the upstream
+                self.circuit.release()
+                raise deadline.DeadlineExceeded(f'Request budget spent waiting on {method} {self.name or url}.') from e
+            if _breaker.is_failure(e):
+                self.circuit.failure()
+            else:
+                self.circuit.release()
+            raise
+        if response.status_code >= 500:
+            self.circuit.failure()
+        else:
+            self.circuit.success()
+        return self._count_error(method, response)
+
+    def _count_error(self, method, response):
+        # retries return the last 5xx or 429 response instead of raising, which observe() would count
+        if self.name is not None and (response.status_code >= 500 or response.status_code == 429):
+            metrics.UPSTREAM_ERRORS.labels(self.name, method.upper(), f'HTTP{response.status_code}').inc()
+        return response
+
+def _cap(timeout, left):
+    '''Returns timeout, a number or (connect, read) tuple, no longer than left seconds.'''
+    left = max(left, 0.001)
+    if timeout is None:
+        return left
+    if isinstance(timeout, (tuple, list)):
+        return tuple(min(t, left) if t is not None else left for t in timeout)
+    return min(timeout, left)
+
+def settings(name):
+    '''Returns the transport settings of a client, defaults overridden by config.yaml.'''
+    http_config = config.get('http') or {}
+    merged = dict(DEFAULTS)
+    merged['retries'] = dict(DEFAULTS['retries'])
+    merged['breaker'] = dict(DEFAULTS['breaker'])
+    for overrides in (http_config, (http_config.get('clients') or {}).get(name) or {}):
+        for key, value in overrides.items():
+            if key == 'clients':
+                continue
+            if key in ('retries', 'breaker') and isinstance(value, dict):
+                merged[key].update(value)
+            else:
+                merged[key] = value
+    return merged
+
+def create_session(name=None, pool_connections=10, pool_maxsize=10, timeout=10, retries=None, breaker=None):
+    '''Creates a Session with sized connection pools and a retry/backoff policy.
+    Only idempotent methods are retried, so POSTs are never sent twice. Named
+    sessions share the circuit breaker of their upstream, created with the
+    breaker settings.
+    '''
+    if isinstance(timeout, list):
+        timeout = tuple(timeout)
+    circuit = _breaker.get(name, **breaker) if name and breaker else None
+    session = Session(name=name, timeout=timeout, circuit=circuit)
+    # return the last 5xx response when retries run out, so callers' raise_for_status() raises HTTPError
+    retry = Retry(**{'raise_on_status': False, **retries}) if retries else Retry(0)
+    adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=retry)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+def circuit(name):
+    '''Returns the circuit breaker of an upstream, e.g. to breaker.guard() a
+    client that does not use a Session, or None when turned off with breaker: false.
+    '''
+    options = settings(name)['breaker']
+    return _breaker.get(name, **options) if options else None
+
+def get_session(name):
+    '''Returns the shared Session of a client, creating it on first use.'''
+    with _lock:
+        if name not in _sessions:
+            _sessions[name] = create_session(name, **settings(name))
+        return _sessions[name]
@@ -0,0 +1,51 @@
+from loguru import logger
+
+# CMDB columns the sweep reads
+WARRANTY_FIELDS = ['sys_id', 'serial_number', 'warranty_expiration']
+
+class WarrantySweep:
+    '''Pulls coverage of every Cisco configuration item in the CMDB in bulk and
+    keeps it in a cache, keyed by serial number, for checks.check_warranty.
+    Warranty dates that changed are pushed back to SNOW in bulk.
+
+    Parameters
+    ----------
+    snow_api : snow.SnowApi
+    support_api : cisco.support.SupportApi or cisco.support.SimulatedSupportApi
+    coverage_cache : cache.TTLCache
+        Cache of coverage summaries. Its ttl should outlast the sweep interval.
+    batch_size : int
+        Serial numbers per coverage request, the Cisco API accepts up to 75.
+    page_size : int
+        Configuration items per CMDB page.
+    '''
+    def __init__(self, snow_api, support_api, coverage_cache, batch_size=75, page_size=1000):
+        self.snow_api = snow_api
+        self.support_api = support_api
+        self.coverage_cache = coverage_cache
+        self.batch_size = batch_size
+        self.page_size = page_size
+
+    def run(self):
+        logger.info('Sweeping warranty coverage of Cisco configuration items...')
+        cis = [ci for ci in self.snow_api.iter_cis_filtered_by({'manufacturer.name': ['Cisco']}, fields=WARRANTY_FIELDS, page_size=self.page_size)
+               if ci['serial_number']]
+        serials = list({ci['serial_number'] for ci in cis})
+        summaries = {}
+        for start in range(0, len(serials), self.batch_size):
+            for summary in self.support_api.get_coverage_summary_by_sn(serials[start:start + self.batch_size]):
+                if summary.get('sr_no'):
+                    summaries[summary['sr_no']] = summary
+                    self.coverage_cache.set(summary['sr_no'], summary)
+
+        updates = {}
+        for ci in cis:
+            summary = summaries.get(ci['serial_number'])
+            if summary and summary['warranty_end_date'] and summary['warranty_end_date'] != ci['warranty_expiration']:
+                updates[ci['sys_id']] = {'warranty_expiration': summary['warranty_end_date']}
+        if updates:
+            logger.info(f'Updating warranty expiration of {len(updates)} configuration item(s)...')
+            failed = self.snow_api.set_fields('cmdb_ci', updates)
+            if failed:
+                logger.error(f'Failed to update warranty expiration of configuration item(s): {", ".join(failed)}.')
+        logger.info(f'Warranty sweep complete: {len(serials)} serial number(s) checked.')